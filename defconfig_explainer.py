@@ -5,13 +5,26 @@
 import sys
 import os
 import re
+import gc
+import copy
+import json
+import shlex
+import string
+import time
+import glob
 import argparse
-from kconfiglib import Kconfig, expr_value, \
-                       Symbol, Choice, MENU, COMMENT, BOOL, TRISTATE, STRING, INT, HEX, UNKNOWN
+import multiprocessing
+from kconfiglib import Kconfig, ParseCache, expr_value, expr_compile, expr_items, purge_cache, \
+                       Symbol, Choice, MENU, COMMENT, BOOL, TRISTATE, STRING, INT, HEX, UNKNOWN, TRI_TO_STR
 
 class DefConfigExplainer:
 
     class Node:
+        # One Node is created per displayed Kconfig menu node, so keep them small
+        __slots__ = ("menu_node", "parent", "level", "next", "list", "defined", "config",
+                     "is_symbol", "is_choice", "is_menu", "prompt",
+                     "list_defined", "list_all_symbol")
+
         def __init__(self, menu_node, parent, level):
             self.menu_node = menu_node
             self.parent    = parent
@@ -24,7 +37,29 @@ class DefConfigExplainer:
             self.is_choice = menu_node.item.__class__ is Choice
             self.is_menu   = menu_node.item is MENU or menu_node.is_menuconfig is True
             self.prompt    = menu_node.prompt[0] if menu_node.prompt else None
-            self.help      = menu_node.help if hasattr(menu_node, "help") else None
+            # Flags of the nodes in 'list', for print_same_level_item: some
+            # node is defined, and all nodes are symbols. The node is added
+            # to the list of 'parent'.
+            self.list_defined    = False
+            self.list_all_symbol = True
+            if parent is not None and self.is_symbol is False:
+                parent.list_all_symbol = False
+
+        @property
+        def help(self):
+            # Help texts are read in by Kconfig only when accessed
+            return getattr(self.menu_node, "help", None)
+
+    class Config:
+        # A config line read from a defconfig file, with the comment lines
+        # before it. 'symbol' is None for configs not defined in Kconfig.
+        __slots__ = ("name", "line", "symbol", "comment")
+
+        def __init__(self, name, line, symbol, comment):
+            self.name    = name
+            self.line    = line
+            self.symbol  = symbol
+            self.comment = comment
 
     _OPTIONS = {
         "warnings"              : (False , "print warning"),
@@ -53,6 +88,23 @@ class DefConfigExplainer:
         "menu_end_format"       : ("#{prompt_indent} end of {prompt}\n", None),
     }
 
+    # Options that the compiled print formats depend on
+    _FORMAT_OPTIONS = (
+        "print_first_level"     ,
+        "print_max_column"      ,
+        "prompt_indent_char"    ,
+        "separator_indent_char" ,
+        "info_indent_char"      ,
+        "separator_char_list"   ,
+        "separator_format"      ,
+        "prompt_format"         ,
+        "help_format"           ,
+        "help_line_format"      ,
+        "orig_config_format"    ,
+        "location_format"       ,
+        "menu_end_format"       ,
+    )
+
     @classmethod
     def options(cls):
         options_dict = {}
@@ -65,16 +117,41 @@ class DefConfigExplainer:
             options_dict[name] = {"name": name, "value": value, "help": _help}
         return options_dict
     
-    def __init__(self, kconfig_file, options={}):
-        self.kconf = Kconfig(kconfig_file)
+    def __init__(self, kconfig_file, options={}, cache_dir=None, shell_cache=True, shell_jobs=1, parse_cache=None,
+                 compile_exprs=False, sparse_tree=False):
+        self.kconf = Kconfig(kconfig_file, cache_dir=cache_dir, shell_cache=shell_cache, shell_jobs=shell_jobs, lazy_help=True,
+                             parse_cache=parse_cache)
+        # Compiled menu node dependencies (see kconfiglib.expr_compile()), by
+        # id() of the dependency expression. Only dependencies that aren't a
+        # single symbol are compiled. Compiling only pays off when the node
+        # tree is built for many defconfig files, so it is optional.
+        self.dep_value_funcs = {} if compile_exprs else None
+        self.dep_values = {}
+        # Build the node tree from the defined configs upward, with only the
+        # nodes that can get printed (see make_sparse_node_tree()), instead
+        # of from all menu nodes. The output is the same, but fewer
+        # dependencies get evaluated, so the full tree is still built while
+        # Kconfig warnings are enabled, to not lose the warnings.
+        self.sparse_tree = sparse_tree
+        # The print options the current sparse tree was built for, or None
+        # if the current tree is a full tree
+        self.sparse_tree_options = None
+        # Symbols and choices in each menu node dependency, by id() of the
+        # dependency expression (see update_node_tree())
+        self.dep_items = {}
+        # True while the node tree matches the symbol values, so that it can
+        # be updated instead of rebuilt when more files are merged
+        self.node_tree_current = False
+        # Compiled per-level print formats, by the format options and the
+        # number of levels (see generate_print_format())
+        self.print_format_cache = {}
 
         self.options = DefConfigExplainer.options()
         self.update_options(options)
         self.update_kconf_option()
         
         self.comment_match = re.compile(r"^#").match
-        self.defined_config_list = []
-        self.defined_config_dict = {}
+        self.clear_defined_configs()
         self.max_level           = 0
         self.level_size          = 0
         self.top_node            = None
@@ -126,19 +203,173 @@ class DefConfigExplainer:
 
     def preload_config_files(self, defconfig_files = [], verbose = None):
         replace = True
-        for defconfig_file in defconfig_files:
-            self.kconf.load_config(defconfig_file, replace, verbose)
-            replace = False
+        # The node tree doesn't follow these values
+        self.node_tree_current = False
+        # Recalculate the symbol values once, after all files are loaded
+        with self.kconf.batch():
+            for defconfig_file in defconfig_files:
+                self.kconf.load_config(defconfig_file, replace, verbose)
+                replace = False
+
+    def clear_defined_configs(self):
+        self.defined_config_list = []
+        self.defined_config_dict = {}
 
     def load_config_files(self, defconfig_files = [], replace = True, verbose = None):
-        for defconfig_file in defconfig_files:
-            self.kconf.load_config(defconfig_file, replace, verbose)
-        for defconfig_file in defconfig_files:
-            self.load_config(defconfig_file)
+        if replace is True:
+            self.clear_defined_configs()
+        merged_config_list = []
+        # Recalculate the symbol values once, after all files are merged
+        with self.kconf.batch():
+            for defconfig_file in defconfig_files:
+                # Collect the explained configs while Kconfig reads the file,
+                # so that it is read only once
+                config_list = []
+                self.kconf.load_config(defconfig_file, replace, verbose,
+                                       line_callback=self.config_line_collector(config_list))
+                self.add_defined_configs(config_list)
+                merged_config_list.extend(config_list)
+        if replace is True or self.node_tree_current is False:
+            self.build_node_tree()
+        else:
+            self.update_node_tree(merged_config_list)
+        self.generate_print_format()
+
+    def build_node_tree(self):
         self.max_level  = 0
-        self.top_node   = self.make_node_tree(self.kconf.top_node, None, 0)
+        if self.sparse_tree is True and self.kconf.warn is False:
+            self.top_node = self.make_sparse_node_tree()
+        else:
+            self.sparse_tree_options = None
+            self.top_node = self.make_node_tree(self.kconf.top_node, None, 0)
         self.level_size = self.max_level + 1
-        self.generate_print_format()
+        self.node_tree_current = True
+
+    def update_node_tree(self, config_list):
+        # Updates the node tree after the configs in 'config_list' have been
+        # merged, to match what build_node_tree() would build. Only the menu
+        # nodes of the merged configs, and the menu nodes of defined configs
+        # whose dependencies contain a symbol that might have changed value,
+        # are checked again.
+        changed   = set()
+        stack     = [config.symbol for config in config_list if config.symbol is not None]
+        # Checking the dependencies of all defined configs is cheaper than
+        # finding everything that depends on e.g. a symbol at the top of a
+        # big menu
+        max_items = 16*len(self.defined_config_dict)
+        check_all = False
+        while stack:
+            item = stack.pop()
+            if item not in changed:
+                if len(changed) == max_items:
+                    check_all = True
+                    break
+                changed.add(item)
+                stack.extend(item._dependents)
+        # The type of every tristate symbol depends on MODULES
+        if self.kconf.modules in changed:
+            check_all = True
+        merged_names = {config.name for config in config_list}
+        dep_items    = self.dep_items
+        self.dep_values = {}
+        for name, menu_node in self.defined_menu_nodes(self.defined_config_dict):
+            if name not in merged_names and check_all is False:
+                items = dep_items.get(id(menu_node.dep))
+                if items is None:
+                    items = dep_items[id(menu_node.dep)] = expr_items(menu_node.dep)
+                if changed.isdisjoint(items):
+                    continue
+            if self.dep_value(menu_node.dep) > 0:
+                config = self.defined_config_dict[name]
+            else:
+                config = None
+            node = self.find_node(menu_node, config is not None)
+            if node is not None and node.config is not config:
+                node.config = config
+                self.update_defined(node)
+        self.level_size = self.max_level + 1
+
+    def update_defined(self, node):
+        # Updates the 'defined' and 'list_defined' flags of 'node' and its
+        # ancestors after the config of 'node' changed. A node is defined if
+        # it has a config or a defined child.
+        while node:
+            list_defined = False
+            child        = node.list
+            while child and list_defined is False:
+                list_defined = child.defined
+                child        = child.next
+            node.list_defined = list_defined
+            defined = node.config is not None or list_defined
+            if node.defined is defined:
+                break
+            node.defined = defined
+            if defined is True and self.sparse_tree_options is not None:
+                # Create the sibling lists that make_sparse_node_tree()
+                # would create
+                same_level, choice_item = self.sparse_tree_options
+                if same_level is True and node.parent:
+                    self.fill_node_list(node.parent)
+                if choice_item is True and node.is_choice:
+                    self.fill_node_list(node)
+            node = node.parent
+
+    def find_node(self, menu_node, create):
+        # Returns the node for 'menu_node'. If it isn't in the (sparse) tree,
+        # it is created along with its ancestors if 'create' is True, and
+        # None is returned otherwise.
+        menu_node_path = []
+        while menu_node.parent:
+            menu_node_path.append(menu_node)
+            menu_node = menu_node.parent
+        node = self.top_node
+        for menu_node in reversed(menu_node_path):
+            parent_node = node
+            node = parent_node.list
+            while node and node.menu_node is not menu_node:
+                node = node.next
+            if node is None:
+                if create is False:
+                    return None
+                node = self.fill_node_list(parent_node, menu_node)
+        return node
+
+    def fill_node_list(self, parent_node, menu_node=None):
+        # Creates the child nodes of 'parent_node' that are missing from a
+        # sparse tree, in menu order. Only the node for 'menu_node' is
+        # created, or all of them if 'menu_node' is None. Returns the last
+        # node created.
+        curr_node = None
+        prev_node = None
+        node      = parent_node.list
+        walk_node = parent_node.menu_node.list
+        level     = parent_node.level + 1
+        while walk_node:
+            if node and node.menu_node is walk_node:
+                prev_node = node
+                node      = node.next
+            elif menu_node is None or menu_node is walk_node:
+                curr_node = DefConfigExplainer.Node(walk_node, parent_node, level)
+                curr_node.next = node
+                if prev_node:
+                    prev_node.next = curr_node
+                else:
+                    parent_node.list = curr_node
+                prev_node = curr_node
+                if self.max_level < level:
+                    self.max_level = level
+            walk_node = walk_node.next
+        return curr_node
+
+    def defined_menu_nodes(self, names):
+        # Generates (name, menu node) pairs for the menu nodes of the symbols
+        # and named choices with the names in 'names'
+        kconf = self.kconf
+        for name in names:
+            for item in (kconf.syms.get(name), kconf.named_choices.get(name)):
+                if item is not None:
+                    for menu_node in item.nodes:
+                        yield name, menu_node
         
     def generate_print_format(self, options={}):
         self.update_options(options)
@@ -149,6 +380,28 @@ class DefConfigExplainer:
         self.print_choice_item        = self.get_option("print_choice_item")
         self.print_same_level_item    = self.get_option("print_same_level_item")
 
+        # The sparse tree only has the sibling lists that the options it was
+        # built for print in full
+        if self.sparse_tree_options is not None and self.top_node is not None and \
+           self.sparse_tree_options != (self.print_same_level_item, self.print_choice_item):
+            self.build_node_tree()
+
+        self.print_first_level        = self.get_option("print_first_level")
+
+        # Formats compiled for more levels also work for smaller trees
+        fingerprint   = tuple(tuple(value) if value.__class__ is list else value
+                              for value in map(self.get_option, DefConfigExplainer._FORMAT_OPTIONS))
+        print_formats = self.print_format_cache.get(fingerprint)
+        if print_formats is None or len(print_formats[0]) < self.level_size:
+            print_formats = self.print_format_cache[fingerprint] = self.compile_print_formats()
+        (self.print_prompt_format     ,
+         self.print_menu_end_format   ,
+         self.print_location_format   ,
+         self.print_help_format       ,
+         self.print_help_line_format  ,
+         self.print_orig_config_format) = print_formats
+
+    def compile_print_formats(self):
         _print_first_level            = self.get_option("print_first_level")
         _print_max_column             = self.get_option("print_max_column")
         _prompt_indent_char           = self.get_option("prompt_indent_char")
@@ -165,13 +418,13 @@ class DefConfigExplainer:
 
         separator_char_list           = ['']*self.level_size
         separator_char_list[_print_first_level:_print_first_level+len(_separator_char_list)] = _separator_char_list
-        self.print_first_level        = _print_first_level
-        self.print_prompt_format      = []
-        self.print_menu_end_format    = []
-        self.print_location_format    = []
-        self.print_help_format        = []
-        self.print_help_line_format   = []
-        self.print_orig_config_format = []
+        compile_format                = DefConfigExplainer.compile_format
+        print_prompt_format           = []
+        print_menu_end_format         = []
+        print_location_format         = []
+        print_help_format             = []
+        print_help_line_format        = []
+        print_orig_config_format      = []
         for level in range(self.level_size):
             format_params = {
                 "prompt_indent"    : _prompt_indent_char    * level,
@@ -193,209 +446,407 @@ class DefConfigExplainer:
             help_line_format   = _help_line_format.format(**format_params)
             location_format    = _location_format.format(**format_params)
             orig_config_format = _orig_config_format.format(**format_params)
-            self.print_prompt_format.append(prompt_format)
-            self.print_menu_end_format.append(menu_end_format)
-            self.print_help_format.append(help_format)
-            self.print_help_line_format.append(help_line_format)
-            self.print_orig_config_format.append(orig_config_format)
-            self.print_location_format.append(location_format)
+            print_prompt_format.append(compile_format(prompt_format, ("prompt",)))
+            print_menu_end_format.append(compile_format(menu_end_format, ("prompt",)))
+            print_help_format.append(compile_format(help_format, ("help",)))
+            print_help_line_format.append(compile_format(help_line_format, ("help_line",)))
+            print_orig_config_format.append(compile_format(orig_config_format, ("config",)))
+            print_location_format.append(compile_format(location_format, ("filename", "linenr")))
+        return (print_prompt_format, print_menu_end_format, print_location_format,
+                print_help_format, print_help_line_format, print_orig_config_format)
+
+    @staticmethod
+    def compile_format(format, names):
+        # Returns a function that takes the values of the fields in 'names'
+        # as arguments and returns the same string as format.format(), but
+        # without parsing 'format' on every call. The values of single field
+        # formats must be strings.
+        literals = []
+        indexes  = []
+        try:
+            for literal, field, spec, conversion in string.Formatter().parse(format):
+                literals.append(literal)
+                if field is None:
+                    continue
+                if field not in names or spec or conversion:
+                    raise ValueError(field)
+                indexes.append(names.index(field))
+        except ValueError:
+            # Let format() handle (and report errors in) anything else
+            def render(*values):
+                return format.format(**dict(zip(names, values)))
+            return render
+        if not indexes:
+            text = "".join(literals)
+            def render(*values):
+                return text
+        elif len(names) == 1 and len(indexes) == 1:
+            prefix = literals[0]
+            suffix = "".join(literals[1:])
+            def render(value):
+                return prefix + value + suffix
+        else:
+            parts = tuple(zip(literals, indexes + [None]))
+            def render(*values):
+                return "".join([literal if index is None else literal + str(values[index])
+                                for literal, index in parts])
+        return render
         
     def print(self, params={}, file=sys.stdout):
         if not params:
             self.generate_print_format(params)
+        # The output is collected in 'out' and written with a single write()
+        out = []
         if self.print_first_level == 1:
-            self.print_node_tree(self.top_node.list, False, file)
+            self.print_node_tree(self.top_node.list, False, out)
         else:
-            self.print_node_tree(self.top_node     , False, file)
+            self.print_node_tree(self.top_node     , False, out)
+        file.write("".join(out))
             
-    def print_node_tree(self, node, force_print, file):
-        if self.print_same_level_item is True:
-            found_defined = False
-            all_symbol    = True
-            walk_node     = node
-            while walk_node:
-                if walk_node.defined:
-                    found_defined = True
-                if not walk_node.is_symbol:
-                    all_symbol = False
-                walk_node = walk_node.next
-            if found_defined is True and all_symbol is True:
-                force_print = True
-        while node:
+    def print_node_tree(self, node, force_print, out):
+        # Prints 'node', its siblings and the lists below them. The tree is
+        # walked with an explicit stack of the nodes whose lists are being
+        # printed, so deep menus don't recurse.
+        stack                 = []
+        print_same_level_item = self.print_same_level_item
+        if print_same_level_item is True and node and node.parent and \
+           node.parent.list_defined and node.parent.list_all_symbol:
+            force_print = True
+        while True:
+            if node is None:
+                # End of a list. Close the menu it is in.
+                if not stack:
+                    return
+                node, force_print = stack.pop()
+                if node.is_menu and node.prompt:
+                    format = self.print_menu_end_format[node.level]
+                    out.append(format(node.prompt))
+                    out.append("\n")
+                node = node.next
+                continue
             if node.defined is True or force_print is True:
-                if node.is_menu:
-                    self.print_menu_node(  node, force_print, file)
-                else:
-                    self.print_config_node(node, force_print, file)
+                self.print_node(node, force_print, out)
+                if node.list or node.is_menu:
+                    stack.append((node, force_print))
+                    if print_same_level_item is True and node.list_defined and node.list_all_symbol:
+                        # A list of symbols is printed in full if any of
+                        # them is defined
+                        force_print = True
+                    else:
+                        force_print = node.is_menu and self.print_choice_item and node.is_choice
+                    node = node.list
+                    continue
             node = node.next
 
-    def print_menu_node(self, node, force_print, file):
-        need_new_line = False
-        if node.prompt:
-            self.print_node_prompt(node, file)
-            need_new_line = True
-            if self.print_help and node.help:
-                self.print_node_help(node, file)
-            if self.print_location:
-                self.print_node_location(node, file)
-        if self.print_comment:
-            self.print_node_comment(node, file)
-        if node.config or self.print_orig_config or force_print:
-            self.print_node_config(node, file)
-            need_new_line = True
-        if need_new_line is True:
-            print("", file=file)
-        if node.list:
-            print_choice_item = self.print_choice_item and node.is_choice
-            self.print_node_tree(node.list, print_choice_item, file)
-        if node.prompt:
-            format = self.print_menu_end_format[node.level]
-            print(format.format(prompt=node.prompt), file=file)
-        
-    def print_config_node(self, node, force_print, file):
+    def print_ndjson(self, file=sys.stdout):
+        # Writes one JSON object per line for each node with a defined
+        # config, in menu order. The records are written while walking the
+        # defined nodes, without collecting the whole output first.
+        encode    = json.JSONEncoder().encode
+        top_node  = self.top_node
+        menu_path = []
+        node      = top_node.list if top_node else None
+        while node:
+            if node.defined is True:
+                if node.config:
+                    file.write(encode(self.ndjson_record(node, menu_path)))
+                    file.write("\n")
+                if node.list:
+                    menu_path.append(node.prompt)
+                    node = node.list
+                    continue
+            while node.next is None and node.parent is not top_node:
+                node = node.parent
+                menu_path.pop()
+            node = node.next
+
+    def ndjson_record(self, node, menu_path):
+        config    = node.config
+        menu_node = node.menu_node
+        item      = menu_node.item
+        if item.user_value is not None and item.type in (BOOL, TRISTATE):
+            user_value = TRI_TO_STR[item.user_value]
+        else:
+            user_value = item.user_value
+        return {
+            "name"       : config.name,
+            "line"       : config.line,
+            "prompt"     : node.prompt,
+            "help"       : node.help,
+            "level"      : node.level,
+            "menu"       : [prompt for prompt in menu_path if prompt],
+            "filename"   : menu_node.filename,
+            "linenr"     : menu_node.linenr,
+            "comment"    : config.comment or None,
+            "value"      : item.str_value,
+            "user_value" : user_value,
+        }
+
+    def print_node(self, node, force_print, out):
         need_new_line = False
         if node.prompt:
-            self.print_node_prompt(node, file)
+            self.print_node_prompt(node, out)
             need_new_line = True
             if self.print_help and node.help:
-                self.print_node_help(node, file)
+                self.print_node_help(node, out)
             if self.print_location:
-                self.print_node_location(node, file)
+                self.print_node_location(node, out)
         if self.print_comment:
-            self.print_node_comment(node, file)
+            self.print_node_comment(node, out)
         if node.config or self.print_orig_config or force_print:
-            self.print_node_config(node, file)
+            self.print_node_config(node, out)
             need_new_line = True
         if need_new_line is True:
-            print("", file=file)
-        if node.list:
-            self.print_node_tree(node.list, False, file)
+            out.append("\n")
 
-    def print_node_config(self, node, file):
+    def print_node_config(self, node, out):
         if node.config:
-            print(node.config["line"] , file=file)
+            out.append(node.config.line)
+            out.append("\n")
         elif node.is_symbol:
             sym    = node.menu_node.item
             config = sym.config_string.rstrip().lstrip("# ")
             format = self.print_orig_config_format[node.level]
-            print(format.format(config=config), file=file)
+            out.append(format(config))
+            out.append("\n")
         
-    def print_node_prompt(self, node, file):
+    def print_node_prompt(self, node, out):
         format = self.print_prompt_format[node.level]
-        print(format.format(prompt=node.prompt), file=file)
+        out.append(format(node.prompt))
+        out.append("\n")
         
-    def print_node_help(self, node, file):
+    def print_node_help(self, node, out):
         help_lines       = []
         help_line_format = self.print_help_line_format[node.level]
         help_format      = self.print_help_format[node.level]
         for help_line in node.help.splitlines():
-            help_lines.append(help_line_format.format(help_line=help_line))
-        print(help_format.format(help="\n".join(help_lines)), file=file)
+            help_lines.append(help_line_format(help_line))
+        out.append(help_format("\n".join(help_lines)))
+        out.append("\n")
         
-    def print_node_location(self, node, file):
+    def print_node_location(self, node, out):
         filename = node.menu_node.filename
         linenr   = node.menu_node.linenr
         format   = self.print_location_format[node.level]
-        print(format.format(filename=filename,linenr=linenr), file=file)
+        out.append(format(filename, linenr))
+        out.append("\n")
         
-    def print_node_comment(self, node, file):
+    def print_node_comment(self, node, out):
         if node.config:
-            comment = node.config["comment"]
-            print(comment)
+            out.append(node.config.comment)
+            out.append("\n")
 
     def make_node_tree(self, menu_node, parent_node, level):
+        # Builds the nodes for 'menu_node', its siblings and everything below
+        # them, and returns the first one. The menu tree is walked without
+        # recursion, like Kconfig.node_iter() does.
         first_node = None
         prev_node  = None
-        while menu_node:
+        if parent_node is None:
+            # Dependency values by id() of the dependency expression, for this
+            # tree. Kconfig interns expressions, so nodes with the same
+            # dependencies (e.g. within the same menu) share one expression.
+            self.dep_values = {}
+        dep_values      = self.dep_values
+        dep_value_funcs = self.dep_value_funcs
+        top_level       = level
+        while True:
+            if menu_node is None:
+                # End of a list. Continue after its parent node.
+                if level == top_level:
+                    return first_node
+                prev_node   = parent_node
+                parent_node = parent_node.parent
+                menu_node   = prev_node.menu_node.next
+                level      -= 1
+                continue
             curr_node = DefConfigExplainer.Node(menu_node, parent_node, level)
-            ## print(f"===> {curr_node.menu_node}")
-            ## print(f"    visibility {curr_node.menu_node.visibility}")
-            ## print(f"    referenced {curr_node.menu_node.referenced}")
-            ## print(f"    class      {menu_node.item.__class__}")
-            ## print(f"    dep        {expr_value(curr_node.menu_node.dep)}")
-            if expr_value(curr_node.menu_node.dep) > 0:
+            dep = menu_node.dep
+            if dep.__class__ is not tuple:
+                dep_value = expr_value(dep)
+            else:
+                dep_value = dep_values.get(id(dep))
+                if dep_value is None:
+                    if dep_value_funcs is None:
+                        dep_value = expr_value(dep)
+                    else:
+                        dep_value_func = dep_value_funcs.get(id(dep))
+                        if dep_value_func is None:
+                            dep_value_func = dep_value_funcs[id(dep)] = expr_compile(dep)
+                        dep_value = dep_value_func()
+                    dep_values[id(dep)] = dep_value
+            if dep_value > 0:
                 if isinstance(menu_node.item, Symbol) or isinstance(menu_node.item, Choice) :
                     name = menu_node.item.name
-                    ## print(f"    name {name}")
                     if name in self.defined_config_dict:
                         curr_node.defined = True
                         curr_node.config  = self.defined_config_dict[name]
                         parent = parent_node
-                        while parent and parent.defined is False:
-                            parent.defined = True
+                        while parent and parent.list_defined is False:
+                            parent.list_defined = True
+                            parent.defined      = True
                             parent = parent.parent
-                    ## print(f"    defined {curr_node.defined}")
-            if menu_node.list:
-                curr_node.list = self.make_node_tree(menu_node.list, curr_node, level+1)
             if prev_node:
                 prev_node.next = curr_node
-            else:
+            elif level == top_level:
                 first_node = curr_node
-            prev_node = curr_node
-            menu_node = menu_node.next
-        if self.max_level < level:
-            self.max_level = level
-        return first_node
+            else:
+                parent_node.list = curr_node
+            if self.max_level < level:
+                self.max_level = level
+            if menu_node.list:
+                # Continue with the list of the new node
+                prev_node   = None
+                parent_node = curr_node
+                menu_node   = menu_node.list
+                level      += 1
+            else:
+                prev_node   = curr_node
+                menu_node   = menu_node.next
         
+    def make_sparse_node_tree(self):
+        # Builds the tree that make_node_tree() builds, minus the nodes that
+        # print() never reaches. Only the defined nodes (the nodes of defined
+        # configs and their ancestors) and, for print_same_level_item and
+        # print_choice_item, the sibling lists they print are created, so the
+        # work depends on the size of the defconfig files rather than on the
+        # size of the Kconfig tree.
+        same_level  = self.get_option("print_same_level_item")
+        choice_item = self.get_option("print_choice_item")
+        self.sparse_tree_options = (same_level, choice_item)
+        self.dep_values = {}
+
+        kconf         = self.kconf
+        defined_nodes = set()
+        config_nodes  = {}
+        # Menu nodes whose children are all created
+        full_lists    = set()
+        for name, menu_node in self.defined_menu_nodes(self.defined_config_dict):
+            if self.dep_value(menu_node.dep) <= 0:
+                continue
+            config_nodes[menu_node] = self.defined_config_dict[name]
+            while menu_node and menu_node not in defined_nodes:
+                defined_nodes.add(menu_node)
+                if same_level is True and menu_node.parent:
+                    full_lists.add(menu_node.parent)
+                if choice_item is True and menu_node.item.__class__ is Choice:
+                    full_lists.add(menu_node)
+                menu_node = menu_node.parent
+
+        top_node = DefConfigExplainer.Node(kconf.top_node, None, 0)
+        if kconf.top_node not in defined_nodes:
+            return top_node
+        top_node.defined = True
+        # Walk the menu tree below the defined nodes without recursion,
+        # like make_node_tree()
+        parent_node = top_node
+        prev_node   = None
+        full_list   = kconf.top_node in full_lists
+        menu_node   = kconf.top_node.list
+        level       = 1
+        while True:
+            if menu_node is None:
+                # End of a list. Continue after its parent node.
+                if parent_node is top_node:
+                    return top_node
+                prev_node   = parent_node
+                parent_node = parent_node.parent
+                full_list   = parent_node.menu_node in full_lists
+                menu_node   = prev_node.menu_node.next
+                level      -= 1
+                continue
+            if menu_node in defined_nodes:
+                curr_node = DefConfigExplainer.Node(menu_node, parent_node, level)
+                curr_node.defined = True
+                curr_node.config  = config_nodes.get(menu_node)
+                parent_node.list_defined = True
+            elif full_list:
+                curr_node = DefConfigExplainer.Node(menu_node, parent_node, level)
+            else:
+                menu_node = menu_node.next
+                continue
+            if prev_node:
+                prev_node.next = curr_node
+            else:
+                parent_node.list = curr_node
+            if self.max_level < level:
+                self.max_level = level
+            if curr_node.defined is True and menu_node.list:
+                # Continue with the list of the new node
+                prev_node   = None
+                parent_node = curr_node
+                full_list   = menu_node in full_lists
+                menu_node   = menu_node.list
+                level      += 1
+            else:
+                prev_node   = curr_node
+                menu_node   = menu_node.next
+
+    def dep_value(self, dep):
+        # Value of the menu node dependency 'dep', like in make_node_tree(),
+        # which has this inlined
+        if dep.__class__ is not tuple:
+            return expr_value(dep)
+        dep_value = self.dep_values.get(id(dep))
+        if dep_value is None:
+            if self.dep_value_funcs is None:
+                dep_value = expr_value(dep)
+            else:
+                dep_value_func = self.dep_value_funcs.get(id(dep))
+                if dep_value_func is None:
+                    dep_value_func = self.dep_value_funcs[id(dep)] = expr_compile(dep)
+                dep_value = dep_value_func()
+            self.dep_values[id(dep)] = dep_value
+        return dep_value
+
+    def config_line_collector(self, config_list):
+        comment_match = self.comment_match
+        comment_lines = []
+        def collect(line, name, sym):
+            nonlocal comment_lines
+            if name is not None:
+                config_info = DefConfigExplainer.Config(name, line,
+                                                        sym if sym and sym.nodes else None,
+                                                        "\n".join(comment_lines))
+                comment_lines = []
+                config_list.append(config_info)
+            elif comment_match(line):
+                comment_lines.append(line)
+            else:
+                comment_lines = []
+        return collect
+
+    def add_defined_configs(self, config_list):
+        self.defined_config_list.extend(config_list)
+        for config_info in config_list:
+            self.defined_config_dict[config_info.name] = config_info
+
     def load_config(self, defconfig_file):
         config_list   = []
-        comment_match = self.comment_match
+        collect       = self.config_line_collector(config_list)
         set_match     = self.kconf._set_match
         unset_match   = self.kconf._unset_match
         get_sym       = self.kconf.syms.get
         with self.kconf._open_config(defconfig_file) as f:
-            comment_lines = []
-            for line_num, line in enumerate(f, 1):
+            for line in f:
                 line = line.rstrip()
-                match = set_match(line)
-                if match:
-                    name, val = match.groups()
-                    sym = get_sym(name)
-                    ## print(f"===> CONFIG_{name}={val}")
-                    config_info = {"name": name, "line": line}
-                    if sym and sym.nodes:
-                        config_info["symbol"] = sym
-                    config_info["comment"] = "\n".join(comment_lines)
-                    comment_lines = []
-                    config_list.append(config_info)
-                    continue
-                match = unset_match(line)
+                match = set_match(line) or unset_match(line)
                 if match:
                     name = match.group(1)
-                    sym = get_sym(name)
-                    ## print(f"===> CONFIG_{name} is unset")
-                    config_info = {"name": name, "line": line}
-                    if sym and sym.nodes:
-                        config_info["symbol"] = sym
-                    config_info["comment"] = "\n".join(comment_lines)
-                    comment_lines = []
-                    config_list.append(config_info)
-                    continue
-                match = comment_match(line)
-                if match:
-                    comment_lines.append(line)
+                    collect(line, name, get_sym(name))
                 else:
-                    comment_lines = []
-        self.defined_config_list.extend(config_list)
-        for config_info in config_list:
-            name = config_info["name"]
-            self.defined_config_dict[name] = config_info
+                    collect(line, None, None)
+        self.add_defined_configs(config_list)
 
 def main():
-    preload_files     = []
-    load_files        = []
-    merge_files       = []
-    output_file       = None
     arch              = os.getenv("ARCH")
-    srcarch           = None
     srctree           = '.'
     kconfig_file      = 'Kconfig'
     cross_compile     = os.getenv("CROSS_COMPILE", "")
     cc                = os.getenv("CC", f"{cross_compile}gcc")
     ld                = os.getenv("LD", f"{cross_compile}ld" )
-    verbose           = False
-    recommended       = False
-    print_options     = DefConfigExplainer.options()
+    cache_dir         = None
+    shell_jobs        = os.cpu_count() or 1
                               
     parser = argparse.ArgumentParser(description="""Defconfig Explainer -- Script to add Kconfig prompts, help, and other explanations to defconfig""")
     parser.add_argument('load_files',
@@ -418,7 +869,7 @@ def main():
                         help    = f"Kconfig File (default={kconfig_file})"),
     parser.add_argument('-o', '--output',
                         type    = str,
-                        default = output_file,
+                        default = None,
                         action  = 'store',
                         help    = """Output File (default=stdout)"""),
     parser.add_argument('-a', '--arch',
@@ -450,6 +901,45 @@ def main():
                         default = ld,
                         action  = 'store',
                         help    = f"Linker Command (default={ld})"),
+    parser.add_argument('--cache-dir',
+                        type    = str,
+                        default = cache_dir,
+                        action  = 'store',
+                        help    = """Kconfig Snapshot Cache Directory (default=None)"""),
+    parser.add_argument('--no-shell-cache',
+                        action  = 'store_true',
+                        help    = """Do not cache $(shell) output in Cache Directory"""),
+    parser.add_argument('--purge-cache',
+                        action  = 'store_true',
+                        help    = """Purge Cache Directory before run"""),
+    parser.add_argument('--shell-jobs',
+                        type    = int,
+                        default = shell_jobs,
+                        action  = 'store',
+                        help    = f"Number of $(shell) commands run concurrently (default={shell_jobs})"),
+    parser.add_argument('--defconfigs',
+                        type    = str,
+                        action  = 'append',
+                        help    = """Explain all defconfig files matching glob pattern or in directory"""),
+    parser.add_argument('--output-dir',
+                        type    = str,
+                        action  = 'store',
+                        help    = """Output Directory for --defconfigs"""),
+    parser.add_argument('--jobs',
+                        type    = int,
+                        default = 1,
+                        action  = 'store',
+                        help    = """Number of worker processes for --defconfigs (default=1)"""),
+    parser.add_argument('--batch',
+                        type    = str,
+                        action  = 'store',
+                        help    = """Batch File (one set of arguments per line, e.g. for each architecture)"""),
+    parser.add_argument('--format',
+                        type    = str,
+                        default = "text",
+                        choices = ["text", "ndjson"],
+                        action  = 'store',
+                        help    = """Output Format (default=text)"""),
     parser.add_argument('-r', '--recommended',
                         action  = 'store_true',
                         help    = """Recommended Print Option"""),
@@ -466,6 +956,130 @@ def main():
 
     args = parser.parse_args()
 
+    if args.batch is not None:
+        explain_batch(parser, args)
+    elif args.defconfigs:
+        explain_defconfigs(args)
+    else:
+        explain(args)
+
+def explain_batch(parser, args):
+    if args.purge_cache is True and args.cache_dir is not None:
+        purge_cache(args.cache_dir)
+
+    with open(args.batch) as f:
+        batch_lines = f.readlines()
+
+    # The parse cache keeps lots of objects alive, which makes the automatic
+    # garbage collections during parsing slow. Collect once after each run instead.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        parse_cache = ParseCache()
+        total_start = time.perf_counter()
+        for batch_line in batch_lines:
+            line_args = shlex.split(batch_line, comments=True)
+            if not line_args:
+                continue
+            run_args = copy.deepcopy(args)
+            run_args.batch       = None
+            run_args.purge_cache = False
+            run_args = parser.parse_args(line_args, namespace=run_args)
+            start = time.perf_counter()
+            if run_args.defconfigs:
+                explain_defconfigs(run_args, parse_cache)
+            else:
+                explain(run_args, parse_cache)
+            gc.collect()
+            label = run_args.arch if run_args.arch is not None else ",".join(run_args.defconfigs or [])
+            print(f"## batch: {label:<12} {time.perf_counter() - start:8.3f} sec", file=sys.stderr)
+        print(f"## batch: {'total':<12} {time.perf_counter() - total_start:8.3f} sec", file=sys.stderr)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+def find_defconfig_files(patterns):
+    defconfig_files = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            if os.path.isdir(path):
+                paths = sorted(glob.glob(os.path.join(path, "*defconfig")))
+            else:
+                paths = [path]
+            for path in paths:
+                if os.path.isfile(path) and path not in defconfig_files:
+                    defconfig_files.append(path)
+    return defconfig_files
+
+def get_srcarch(arch):
+    if   arch == 'i386':
+        return 'x86'
+    elif arch == 'x86_64':
+        return 'x86'
+    elif arch == 'sparc32':
+        return 'sparc'
+    elif arch == 'sparc64':
+        return 'sparc'
+    elif arch == 'parisc64':
+        return 'parisc'
+    else:
+        return arch
+
+def explain_defconfigs(args, parse_cache=None):
+    if args.output_dir is None:
+        print("Error: Output directory is not specified.")
+        sys.exit(1)
+    if args.load_files or args.output is not None:
+        print("Error: --defconfigs can not be used with load files or --output.")
+        sys.exit(1)
+
+    defconfig_files = find_defconfig_files(args.defconfigs)
+    if not defconfig_files:
+        print(f"Error: No defconfig files found in {args.defconfigs}.")
+        sys.exit(1)
+
+    # Group the defconfig files by architecture (arch/ARCH/configs/...), so
+    # that the Kconfig files are parsed only once for each architecture
+    arch_match   = re.compile(r"(?:^|/)arch/([^/]+)/configs/").search
+    default_arch = args.arch
+    arch_files   = {}
+    for defconfig_file in defconfig_files:
+        match = arch_match(os.path.abspath(defconfig_file).replace(os.sep, "/"))
+        if match is None or match.group(1) == (args.srcarch or get_srcarch(default_arch)):
+            arch = default_arch
+        else:
+            arch = match.group(1)
+        output_file = os.path.relpath(defconfig_file, args.srctree)
+        if output_file.startswith(os.pardir):
+            output_file = os.path.basename(defconfig_file)
+        output_file = os.path.join(args.output_dir, output_file)
+        arch_files.setdefault(arch, []).append(([defconfig_file], output_file))
+
+    if args.purge_cache is True and args.cache_dir is not None:
+        purge_cache(args.cache_dir)
+
+    if parse_cache is None:
+        parse_cache = ParseCache()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for arch, defconfig_list in arch_files.items():
+            run_args = copy.deepcopy(args)
+            run_args.arch        = arch
+            run_args.purge_cache = False
+            if arch != default_arch:
+                run_args.srcarch = None
+            for _, output_file in defconfig_list:
+                os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            explain(run_args, parse_cache, defconfig_list)
+            gc.collect()
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+def explain(args, parse_cache=None, defconfig_list=None):
+    print_options     = DefConfigExplainer.options()
+
     load_files        = args.load_files if args.load_files else []
     merge_files       = args.merge      if args.merge      else []
     preload_files     = args.preload    if args.preload    else []
@@ -476,6 +1090,9 @@ def main():
     cross_compile     = args.cross_compile
     cc                = args.cc
     ld                = args.ld
+    cache_dir         = args.cache_dir
+    shell_cache       = not args.no_shell_cache
+    shell_jobs        = args.shell_jobs
     recommended       = args.recommended
     verbose           = args.verbose
 
@@ -542,20 +1159,10 @@ def main():
         else:
             raise KeyError(f"{name} is not option name")
 
-    if   args.srcarch is not None:
+    if args.srcarch is not None:
         srcarch = args.srcarch
-    elif arch == 'i386':
-        srcarch = 'x86'
-    elif arch == 'x86_64':
-        srcarch = 'x86'
-    elif arch == 'sparc32':
-        srcarch = 'sparc'
-    elif arch == 'sparc64':
-        srcarch = 'sparc'
-    elif arch == 'parisc64':
-        srcarch = 'parisc'
     else:
-        srcarch = arch
+        srcarch = get_srcarch(arch)
 
     if cross_compile != "":
         if not cc.startswith(cross_compile):
@@ -567,19 +1174,25 @@ def main():
         print("Error: Architecture is not specified.")
         sys.exit(1)
 
+    # The NDJSON records are written to stdout, so keep it free of other output
+    verbose_file = sys.stderr if args.format == "ndjson" else sys.stdout
     if verbose is True:
-        print(f"## export ARCH={arch}")
-        print(f"## export CROSS_COMPILE={cross_compile}")
-        print(f"## export CC={cc}")
-        print(f"## export LD={ld}")
-        print(f"## export SRCARCH={srcarch}")
-        print(f"## export srctree={srctree}")
-        print(f"## kconfig file = {kconfig_file}")
-        print(f"## preload defconfig files = {preload_files}")
-        print(f"## load defconfig files    = {load_files}")
-        print(f"## merge defconfig files   = {merge_files}")
-        print(f"## output file             = {output_file}")
-        print(f"## print_format_params     = {print_format_params}")
+        print(f"## export ARCH={arch}", file=verbose_file)
+        print(f"## export CROSS_COMPILE={cross_compile}", file=verbose_file)
+        print(f"## export CC={cc}", file=verbose_file)
+        print(f"## export LD={ld}", file=verbose_file)
+        print(f"## export SRCARCH={srcarch}", file=verbose_file)
+        print(f"## export srctree={srctree}", file=verbose_file)
+        print(f"## kconfig file = {kconfig_file}", file=verbose_file)
+        print(f"## cache directory = {cache_dir}", file=verbose_file)
+        print(f"## shell cache     = {shell_cache}", file=verbose_file)
+        print(f"## shell jobs      = {shell_jobs}", file=verbose_file)
+        print(f"## preload defconfig files = {preload_files}", file=verbose_file)
+        print(f"## load defconfig files    = {load_files}", file=verbose_file)
+        print(f"## merge defconfig files   = {merge_files}", file=verbose_file)
+        print(f"## output file             = {output_file}", file=verbose_file)
+        print(f"## output format           = {args.format}", file=verbose_file)
+        print(f"## print_format_params     = {print_format_params}", file=verbose_file)
 
     os.environ["ARCH"]    = arch
     os.environ["SRCARCH"] = srcarch
@@ -589,18 +1202,87 @@ def main():
 
     options = {"undef_warnings": True}
 
-    explainer = DefConfigExplainer(os.path.join(srctree, kconfig_file), options)
+    if args.purge_cache is True and cache_dir is not None:
+        purge_cache(cache_dir)
+
+    if defconfig_list is None:
+        defconfig_list = [(load_files, output_file)]
+
+    explainer = DefConfigExplainer(os.path.join(srctree, kconfig_file), options, cache_dir, shell_cache, shell_jobs, parse_cache,
+                                   compile_exprs=len(defconfig_list) > 1, sparse_tree=True)
+    if args.jobs > 1 and len(defconfig_list) > 1 and "fork" in multiprocessing.get_all_start_methods():
+        explain_defconfig_list_parallel(explainer, preload_files, defconfig_list, merge_files, print_format_params, args.jobs, verbose,
+                                        args.format)
+        return
+    for load_files, output_file in defconfig_list:
+        if verbose is True and len(defconfig_list) > 1:
+            print(f"## explain {load_files} -> {output_file}", file=verbose_file)
+        explain_defconfig(explainer, preload_files, load_files, merge_files, print_format_params, output_file, args.format)
+
+def explain_defconfig(explainer, preload_files, load_files, merge_files, print_format_params, output_file,
+                      output_format="text"):
+    # Set the print and warning options first, as the sparse node tree depends on them
+    explainer.update_options(print_format_params)
+    explainer.update_kconf_option()
     explainer.preload_config_files(defconfig_files=preload_files)
     explainer.load_config_files(defconfig_files=load_files , replace=True )
     explainer.load_config_files(defconfig_files=merge_files, replace=False)
-    
+
     explainer.generate_print_format(print_format_params)
 
+    if output_format == "ndjson":
+        print_func = explainer.print_ndjson
+    else:
+        print_func = explainer.print
     if output_file is None:
-        explainer.print()
+        print_func()
     else:
         with open(output_file, "w") as f:
-            explainer.print(file=f)
+            print_func(file=f)
+
+# Set in the parent process before forking the workers of
+# explain_defconfig_list_parallel(), which inherit it copy-on-write
+_worker_params = None
+
+def _explain_defconfig_worker(index):
+    explainer, preload_files, defconfig_list, merge_files, print_format_params, output_format = _worker_params
+    load_files, output_file = defconfig_list[index]
+    start = time.perf_counter()
+    explain_defconfig(explainer, preload_files, load_files, merge_files, print_format_params, output_file, output_format)
+    return (os.getpid(), time.perf_counter() - start)
+
+def explain_defconfig_list_parallel(explainer, preload_files, defconfig_list, merge_files, print_format_params, jobs, verbose,
+                                    output_format="text"):
+    global _worker_params
+    _worker_params = (explainer, preload_files, defconfig_list, merge_files, print_format_params, output_format)
+    # Keep the garbage collector in the workers away from the objects
+    # inherited from the parent, so that their pages stay shared.
+    # gc.freeze() is only available from Python 3.7.
+    gc_freeze = hasattr(gc, "freeze")
+    if gc_freeze:
+        gc.collect()
+        gc.freeze()
+    worker_stats = {}
+    verbose_file = sys.stderr if output_format == "ndjson" else sys.stdout
+    start = time.perf_counter()
+    try:
+        context = multiprocessing.get_context("fork")
+        with context.Pool(min(jobs, len(defconfig_list))) as pool:
+            # imap() returns the results in the order of defconfig_list
+            results = pool.imap(_explain_defconfig_worker, range(len(defconfig_list)))
+            for (load_files, output_file), (pid, elapsed) in zip(defconfig_list, results):
+                if verbose is True:
+                    print(f"## explain {load_files} -> {output_file}", file=verbose_file)
+                count, busy = worker_stats.get(pid, (0, 0.0))
+                worker_stats[pid] = (count + 1, busy + elapsed)
+    finally:
+        if gc_freeze:
+            gc.unfreeze()
+        _worker_params = None
+    total = time.perf_counter() - start
+    for number, (pid, (count, busy)) in enumerate(sorted(worker_stats.items())):
+        print(f"## jobs: worker {number:<3} {count:5} defconfigs {busy:8.3f} sec {count / busy if busy else 0:8.2f} defconfigs/sec", file=sys.stderr)
+    print(f"## jobs: total      {len(defconfig_list):5} defconfigs {total:8.3f} sec {len(defconfig_list) / total:8.2f} defconfigs/sec", file=sys.stderr)
 
 if __name__ == "__main__":
     main()
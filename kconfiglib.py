@@ -550,6 +550,7 @@ import re
 import sys
 
 # Get rid of some attribute lookups. These are obvious in context.
+from functools import partial
 from glob import iglob
 from os.path import dirname, exists, expandvars, islink, join, realpath
 
@@ -811,10 +812,18 @@ class Kconfig(object):
       See the module docstring.
     """
     __slots__ = (
+        "_discard_help",
         "_encoding",
+        "_exprs",
         "_functions",
+        "_generation",
+        "_help_lines",
+        "_help_stamps",
+        "_lazy_help",
+        "_regex_tokenizer",
         "_set_match",
         "_srctree_prefix",
+        "_tri_plan",
         "_unset_match",
         "_warn_assign_no_prompt",
         "choices",
@@ -858,6 +867,23 @@ class Kconfig(object):
         "_tokens",
         "_tokens_i",
         "_reuse_tokens",
+        "_source_globs",
+        "_unset_env_vars",
+        "_shell_cache",
+        "_shell_cache_dirty",
+        "_shell_executor",
+        "_shell_futures",
+        "_shell_used",
+        "_prefetch_stack",
+        "_token_cache",
+        "_token_cache_dirty",
+        "_file_tokens",
+        "_line_warned",
+        "_parse_cache",
+
+        # Kconfig.batch() state
+        "_batch_depth",
+        "_batch_invalidate",
     )
 
     #
@@ -865,7 +891,10 @@ class Kconfig(object):
     #
 
     def __init__(self, filename="Kconfig", warn=True, warn_to_stderr=True,
-                 encoding="utf-8", suppress_traceback=False):
+                 encoding="utf-8", suppress_traceback=False, cache_dir=None,
+                 shell_cache=True, shell_jobs=1, lazy_help=False,
+                 skip_help=False, regex_tokenizer=False, token_cache=True,
+                 parse_cache=None):
         """
         Creates a new Kconfig object by parsing Kconfig files.
         Note that Kconfig files are not the same as .config files (which store
@@ -942,9 +971,166 @@ class Kconfig(object):
 
           Other exceptions besides EnvironmentError and KconfigError are still
           propagated when suppress_traceback is True.
-        """
+
+        cache_dir (default: None):
+          Directory holding snapshots of parsed configurations. If not None,
+          the fully parsed configuration (symbols, choices, the menu tree, and
+          the dependency information used for invalidation) is loaded from a
+          snapshot in 'cache_dir' instead of parsing the Kconfig files,
+          provided the snapshot is still valid. Otherwise, the Kconfig files
+          are parsed and a new snapshot is written. The directory is created
+          if needed.
+
+          A snapshot is valid as long as none of the Kconfig files have been
+          modified (by modification time and size), the 'source' statements
+          would include the same files, and the environment variables that
+          influence parsing (those in Kconfig.env_vars, plus e.g. ARCH,
+          SRCARCH, CC, and LD) have the same values as when it was written.
+
+          The output of $(shell,...) calls is stored in the snapshot as well.
+          Snapshots that contain it are only valid while the compiler and
+          linker binaries in CC and LD have the same modification time and
+          size, and are not used if 'shell_cache' is False.
+
+          Warnings generated while parsing are stored in the snapshot and
+          reported again when it is loaded.
+
+          Snapshots use the pickle format, so 'cache_dir' should not be
+          writable by untrusted users.
+
+          Use purge_cache() to remove all cached data from 'cache_dir'.
+
+        shell_cache (default: True):
+          If True and 'cache_dir' is not None, the output of commands run via
+          $(shell) while parsing is also cached in 'cache_dir' (independently
+          of snapshots), and reused instead of rerunning the command. This
+          mostly saves time on the many compiler and linker probes done by
+          e.g. cc-option and ld-option in the Linux kernel.
+
+          Cached output is reused if the command string, the working
+          directory, the CC, LD, and CROSS_COMPILE environment variables, and
+          the modification time and size of the compiler and linker binaries
+          are the same. Pass False to always run the commands.
+
+        token_cache (default: True):
+          If True and 'cache_dir' is not None, the tokenized lines of each
+          Kconfig file are also cached in 'cache_dir', keyed by a hash of the
+          file contents, and reused instead of tokenizing the lines again.
+          Most Kconfig files are identical across architectures and
+          toolchains, so this helps when the snapshot of the configuration as
+          a whole can't be reused.
+
+          Lines that reference macros ($(FOO)) are always tokenized, as their
+          expansion might differ between runs. The same goes for preprocessor
+          variable assignments and lines that generate warnings.
+
+        parse_cache (default: None):
+          A ParseCache instance shared with other Kconfig instances created in
+          the same process, e.g. for other architectures. The contents of the
+          Kconfig files, the files matched by 'source' statements, and (if
+          'shell_cache' and 'token_cache' are True) the $(shell) output and
+          tokenized lines are then kept in it and reused by later Kconfig
+          instances, even if 'cache_dir' is None. If 'cache_dir' is not None,
+          the $(shell) output and tokens are also loaded from and saved to
+          'cache_dir' as usual.
+
+          The Kconfig files must not be modified while 'parse_cache' is in
+          use. See the ParseCache class.
+
+        shell_jobs (default: 1):
+          Maximum number of $(shell) commands to run concurrently while
+          parsing. If greater than 1, each Kconfig file is scanned for
+          $(shell) calls (including calls made indirectly via e.g. cc-option)
+          before it is parsed, and the commands are started in the background
+          in a pool of 'shell_jobs' threads. The parser then picks up their
+          output instead of running the commands one at a time.
+
+          Only commands that are known to be run by the parser are started
+          early. The scan stops at each 'source' statement, as the sourced
+          files might change preprocessor variables, and resumes after it.
+
+        lazy_help (default: False):
+          If True, help texts are not stored while parsing. Instead, the
+          location of each help text within its Kconfig file is remembered,
+          and the text is read in from the file the first time MenuNode.help
+          is accessed. This saves time and memory for tools that only look at
+          a few help texts.
+
+          Each Kconfig file is read in at most once for help texts. If a
+          Kconfig file was modified after it was parsed (or after the snapshot
+          was written, with 'cache_dir'), its help texts are not read in.
+          MenuNode.help is "" for them instead, and a warning is generated.
+
+        skip_help (default: False):
+          If True, help texts are skipped over while parsing and not stored
+          at all. MenuNode.help is then None for all menu nodes, except that
+          empty help texts still give "". This is the fastest option for
+          tools that never look at help texts. Line numbers and warnings for
+          empty help texts are unaffected, but warnings for symbols with more
+          than one help text are not generated.
+
+          Takes precedence over 'lazy_help'.
+
+        regex_tokenizer (default: False):
+          If True, lines are split into tokens with a single combined regex
+          where possible, instead of matching one token at a time. The
+          resulting tokens (and symbols, warnings, and errors) are the same
+          either way. Lines with macros or backslashes always use the regular
+          tokenizer.
+        """
+        # Dictionary that maps $(shell) commands to (<stdout>, <stderr>)
+        # tuples, or None if $(shell) output isn't cached. See _shell_fn().
+        self._shell_cache = None
+        # Maps $(shell) commands started early to concurrent.futures.Future
+        # instances. Set here as well as in _init(), as instances loaded from
+        # snapshots run $(shell) commands in eval_string(). See
+        # _prefetch_shell().
+        self._shell_futures = {}
+        # True if any $(shell) commands were run (or taken from the cache)
+        # while parsing. See _save_snapshot().
+        self._shell_used = False
+        # Dictionary that maps hashes of Kconfig file contents to dictionaries
+        # of cached tokens, or None if tokens aren't cached. See
+        # _tokenize_cached().
+        self._token_cache = None
+        # ParseCache shared with other Kconfig instances, or None
+        self._parse_cache = parse_cache
+        # Nesting depth of Kconfig.batch() blocks, and whether all symbol
+        # values need to be invalidated when the outermost block ends
+        self._batch_depth = 0
+        self._batch_invalidate = False
+        # Interning table for expressions while parsing the Kconfig files,
+        # None otherwise. See _intern_expr().
+        self._exprs = None
+        # Lines of the Kconfig files that help texts have been read in from,
+        # for lazy_help. See _load_help().
+        self._help_lines = {}
+        # Evaluation order and compiled expressions for tri_values(), built
+        # when first needed. See _build_tri_plan().
+        self._tri_plan = None
+
         try:
-            self._init(filename, warn, warn_to_stderr, encoding)
+            if cache_dir is None and parse_cache is None:
+                self._init(filename, warn, warn_to_stderr, encoding,
+                           shell_jobs, lazy_help, skip_help,
+                           regex_tokenizer)
+            elif cache_dir is None or \
+                 not self._load_snapshot(filename, warn, warn_to_stderr,
+                                         encoding, skip_help, shell_cache,
+                                         cache_dir):
+                if shell_cache:
+                    self._load_shell_cache(cache_dir)
+                if token_cache:
+                    self._load_token_cache(cache_dir)
+                self._init(filename, warn, warn_to_stderr, encoding,
+                           shell_jobs, lazy_help, skip_help,
+                           regex_tokenizer)
+                if cache_dir is not None:
+                    if shell_cache:
+                        self._save_shell_cache(cache_dir)
+                    if token_cache:
+                        self._save_token_cache(cache_dir)
+                    self._save_snapshot(filename, encoding, cache_dir)
         except (EnvironmentError, KconfigError) as e:
             if suppress_traceback:
                 cmd = sys.argv[0]  # Empty string if missing
@@ -956,10 +1142,18 @@ class Kconfig(object):
                 sys.exit(cmd + str(e).strip())
             raise
 
-    def _init(self, filename, warn, warn_to_stderr, encoding):
+    def _init(self, filename, warn, warn_to_stderr, encoding, shell_jobs,
+              lazy_help, skip_help, regex_tokenizer):
         # See __init__()
 
         self._encoding = encoding
+        self._lazy_help = lazy_help
+        # Stamps of the Kconfig files when they were parsed, by filename
+        # relative to $srctree, for lazy_help. Stored in snapshots. See
+        # _load_help().
+        self._help_stamps = {}
+        self._discard_help = skip_help
+        self._regex_tokenizer = regex_tokenizer
 
         self.srctree = os.getenv("srctree", "")
         # A prefix we can reliably strip from glob() results to get a filename
@@ -976,6 +1170,9 @@ class Kconfig(object):
 
         self.warnings = []
 
+        # Generation of cached symbol and choice values. See _invalidate_all().
+        self._generation = 0
+
         self.config_prefix = os.getenv("CONFIG_", "CONFIG_")
         # Regular expressions for parsing .config files
         self._set_match = _re_match(self.config_prefix + r"([^=]+)=(.*)")
@@ -1039,6 +1236,7 @@ class Kconfig(object):
         # They shouldn't be if we parse expressions after parsing, as part of
         # Kconfig.eval_string().
         self._parsing_kconfigs = True
+        self._exprs = {}
 
         self.modules = self._lookup_sym("MODULES")
         self.defconfig_list = None
@@ -1061,12 +1259,19 @@ class Kconfig(object):
         # Not used internally. Provided as a convenience.
         self.kconfig_filenames = [filename]
         self.env_vars = set()
+        # Names of unset environment variables referenced with $(FOO). Used
+        # to check if snapshots are still valid.
+        self._unset_env_vars = set()
 
         # Keeps track of the location in the parent Kconfig files. Kconfig
         # files usually source other Kconfig files. See _enter_file().
         self._filestack = []
         self._include_path = ()
 
+        # Cached tokens for the current Kconfig file, or None if tokens aren't
+        # cached. See _tokenize_cached().
+        self._file_tokens = None
+
         # The current parsing location
         self.filename = filename
         self.linenr = 0
@@ -1076,11 +1281,41 @@ class Kconfig(object):
         # unget operation.
         self._reuse_tokens = False
 
-        # Open the top-level Kconfig file. Store the readline() method directly
-        # as a small optimization.
-        self._readline = self._open(join(self.srctree, filename), "r").readline
+        # (<pattern>, <matched filenames>) tuples for all 'source' statements,
+        # used to check if snapshots are still valid. See _save_snapshot().
+        self._source_globs = []
+
+        # Thread pool for running $(shell) commands early, or None if commands
+        # are run when the parser gets to them. See _prefetch_shell().
+        self._shell_executor = None
+        # Maps $(shell) commands started early to concurrent.futures.Future
+        # instances
+        self._shell_futures = {}
+        # Lines of the Kconfig files being parsed, for _prefetch_shell()
+        self._prefetch_stack = []
+
+        if shell_jobs > 1:
+            # Only import as needed, to save some startup time
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._shell_executor = ThreadPoolExecutor(shell_jobs)
 
         try:
+            # Read the top-level Kconfig file. See _enter_file().
+            if lazy_help:
+                self._help_stamps[filename] = \
+                    _file_stamp(join(self.srctree, filename))
+            lines = self._read_lines(join(self.srctree, filename))
+            self._readline = _line_reader(lines)
+
+            if self._token_cache is not None:
+                self._file_tokens = \
+                    self._token_cache.setdefault(_lines_hash(lines), {})
+
+            if self._shell_executor:
+                self._prefetch_stack.append(_prefetch_lines(lines))
+                self._prefetch_shell(0)
+
             # Parse the Kconfig files. Returns the last node, which we
             # terminate with '.next = None'.
             self._parse_block(None, self.top_node, self.top_node).next = None
@@ -1088,10 +1323,14 @@ class Kconfig(object):
             self.top_node.next = None
         except UnicodeDecodeError as e:
             _decoding_error(e, self.filename)
-
-        # Close the top-level Kconfig file. __self__ fetches the 'file' object
-        # for the method.
-        self._readline.__self__.close()
+        finally:
+            if self._shell_executor:
+                # Commands that were started early but never used (e.g. due
+                # to a parsing error) are left to finish
+                self._shell_executor.shutdown()
+                self._shell_executor = None
+            self._shell_futures = {}
+            self._prefetch_stack = []
 
         self._parsing_kconfigs = False
 
@@ -1124,6 +1363,12 @@ class Kconfig(object):
         # awkward during dependency loop detection
         self._add_choice_deps()
 
+        # All expressions in the configuration have been built. Drop the
+        # interning table, which would otherwise take up more memory than
+        # interning saves. Expressions parsed later, e.g. by eval_string(),
+        # are not interned, so that the table does not grow back.
+        self._exprs = None
+
     @property
     def mainmenu_text(self):
         """
@@ -1147,10 +1392,12 @@ class Kconfig(object):
 
         return None
 
-    def load_config(self, filename=None, replace=True, verbose=None):
+    def load_config(self, filename=None, replace=True, verbose=None,
+                    line_callback=None):
         """
         Loads symbol values from a file in the .config format. Equivalent to
-        calling Symbol.set_value() to set each of the values.
+        calling Symbol.set_value() to set each of the values within a
+        Kconfig.batch() block.
 
         "# CONFIG_FOO is not set" within a .config file sets the user value of
         FOO to n. The C tools work the same way.
@@ -1204,6 +1451,20 @@ class Kconfig(object):
 
           Will probably be removed in some future version.
 
+        line_callback (default: None):
+          If not None, a function that gets called as
+          line_callback(line, name, sym) for each line in the configuration
+          file, in order, before the line is processed. 'line' is the line
+          with trailing whitespace removed. For assignments
+          ("CONFIG_FOO=..." and "# CONFIG_FOO is not set"), 'name' is the
+          name of the assigned symbol and 'sym' is the Symbol with that name,
+          or None if there isn't one. For other lines (e.g. comments), 'name'
+          and 'sym' are None.
+
+          This allows tools to pick up comments and the like from the
+          configuration file without having to read and match it a second
+          time.
+
         Returns a string with a message saying which file got loaded (or
         possibly that no file got loaded, when 'filename' is None). This is
         meant to reduce boilerplate in tools, which can do e.g.
@@ -1237,7 +1498,8 @@ class Kconfig(object):
         # This stub only exists to make sure _warn_assign_no_prompt gets
         # reenabled
         try:
-            self._load_config(filename, replace)
+            with self.batch():
+                self._load_config(filename, replace, line_callback)
         except UnicodeDecodeError as e:
             _decoding_error(e, filename)
         finally:
@@ -1245,7 +1507,7 @@ class Kconfig(object):
 
         return ("Loaded" if replace else "Merged") + msg
 
-    def _load_config(self, filename, replace):
+    def _load_config(self, filename, replace, line_callback):
         with self._open_config(filename) as f:
             if replace:
                 self.missing_syms = []
@@ -1275,6 +1537,9 @@ class Kconfig(object):
                 if match:
                     name, val = match.groups()
                     sym = get_sym(name)
+                    if line_callback:
+                        line_callback(line, name, sym)
+
                     if not sym or not sym.nodes:
                         self._undef_assign(name, val, filename, linenr)
                         continue
@@ -1325,6 +1590,9 @@ class Kconfig(object):
                 else:
                     match = unset_match(line)
                     if not match:
+                        if line_callback:
+                            line_callback(line, None, None)
+
                         # Print a warning for lines that match neither
                         # set_match() nor unset_match() and that are not blank
                         # lines or comments. 'line' has already been
@@ -1338,6 +1606,9 @@ class Kconfig(object):
 
                     name = match.group(1)
                     sym = get_sym(name)
+                    if line_callback:
+                        line_callback(line, name, sym)
+
                     if not sym or not sym.nodes:
                         self._undef_assign(name, "n", filename, linenr)
                         continue
@@ -1378,20 +1649,27 @@ class Kconfig(object):
     def _assigned_twice(self, sym, new_val, filename, linenr):
         # Called when a symbol is assigned more than once in a .config file
 
+        # The message includes the locations of the symbol's definitions and
+        # is relatively expensive to build. Skip it if warnings are disabled,
+        # as merging configuration fragments can reassign many symbols.
+        if not self.warn:
+            return
+
         # Use strings for bool/tristate user values in the warning
         if sym.orig_type in _BOOL_TRISTATE:
             user_val = TRI_TO_STR[sym.user_value]
         else:
             user_val = sym.user_value
 
-        msg = '{} set more than once. Old value "{}", new value "{}".'.format(
-            sym.name_and_loc, user_val, new_val)
-
         if user_val == new_val:
-            if self.warn_assign_redun:
-                self._warn(msg, filename, linenr)
-        elif self.warn_assign_override:
-            self._warn(msg, filename, linenr)
+            if not self.warn_assign_redun:
+                return
+        elif not self.warn_assign_override:
+            return
+
+        self._warn('{} set more than once. Old value "{}", new value "{}".'
+                   .format(sym.name_and_loc, user_val, new_val),
+                   filename, linenr)
 
     def load_allconfig(self, filename):
         """
@@ -1595,6 +1873,11 @@ class Kconfig(object):
         for sym in self.unique_defined_syms:
             sym._visited = False
 
+        if self._tri_plan is not None:
+            # Evaluate bool/tristate symbols in a single pass, now that it's
+            # set up. See tri_values().
+            self.tri_values()
+
         if header is None:
             header = self.config_header
 
@@ -1697,6 +1980,10 @@ class Kconfig(object):
         # write_min_config() helper. Returns the contents to write as a string,
         # with 'header' or KCONFIG_CONFIG_HEADER at the beginning.
 
+        if self._tri_plan is not None:
+            # See _config_contents()
+            self.tri_values()
+
         if header is None:
             header = self.config_header
 
@@ -1988,6 +2275,181 @@ class Kconfig(object):
 
         return expr_value(self._expect_expr_and_eol())
 
+    def batch(self):
+        """
+        Returns a context manager for setting many values at once:
+
+          with kconf.batch():
+              for name, val in ...:
+                  kconf.syms[name].set_value(val)
+
+        Within the block, Symbol/Choice.set_value() and unset_value() only
+        record the new user values. Instead of invalidating the cached values
+        of dependent symbols on each assignment, all cached values are
+        invalidated once when the block ends. This is much faster when many
+        values are set, e.g. when merging configuration fragments, which
+        would otherwise walk the dependents of each assigned symbol.
+
+        Symbol and choice values read within the block might not reflect the
+        assignments made within it. Blocks can be nested, in which case the
+        invalidation happens when the outermost block ends.
+
+        Kconfig.load_config() and Kconfig.set_values() use batch()
+        internally. Wrap several load_config(..., replace=False) calls in a
+        batch() block to only invalidate once for all of them.
+        """
+        return _Batch(self)
+
+    def set_values(self, values):
+        """
+        Sets the user values of many symbols at once, within a Kconfig.batch()
+        block. See Kconfig.batch().
+
+        values:
+          Dictionary (or other mapping) that maps symbol names to user values.
+          Values are given in the same format as for Symbol.set_value(). A
+          warning is generated for names of undefined symbols, which are
+          skipped.
+
+        Returns True if all the values were valid for the types of the
+        symbols (see Symbol.set_value()) and all the symbols were defined, and
+        False otherwise.
+        """
+        ok = True
+        with self.batch():
+            for name, value in values.items():
+                sym = self.syms.get(name)
+                if not sym or not sym.nodes:
+                    self._warn("attempt to assign the value '{}' to the "
+                               "undefined symbol {}".format(value, name))
+                    ok = False
+                elif not sym.set_value(value):
+                    ok = False
+
+        return ok
+
+    def tri_values(self):
+        """
+        Calculates the tristate values of all defined bool and tristate
+        symbols and all choices in a single pass, and returns them as a
+        TriValues instance. The values are the same as Symbol/Choice.tri_value
+        gives.
+
+        Items are evaluated in topological order, with each item after the
+        items it depends on. A choice and its symbols depend on each other and
+        are evaluated together. Plain bool and tristate symbols are evaluated
+        with expressions compiled once per Kconfig instance (see
+        expr_compile()), which read the values of other items from the array
+        being filled in.
+
+        The calculated values are also cached in the symbols, like when they
+        are calculated through Symbol.tri_value. Calling this function first
+        makes evaluating many symbols faster, and avoids deep recursion for
+        long dependency chains.
+
+        The evaluation order and the compiled expressions are set up on the
+        first call, which takes a few times longer than evaluating all symbols
+        once. After that, write_config() and write_min_config() use
+        tri_values() as well. The setup pays off when evaluating many
+        configurations with the same Kconfig instance.
+        """
+        # Only import as needed, to save some startup time
+        from array import array
+
+        if self._tri_plan is None:
+            import gc
+
+            # Building the plan creates lots of container objects, which
+            # would trigger many pointless garbage collection passes
+            gc_was_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                self._tri_plan = self._build_tri_plan()
+            finally:
+                if gc_was_enabled:
+                    gc.enable()
+
+        index, steps = self._tri_plan
+
+        vals = array("b", (0,)) * len(index)
+        gen = self._generation
+        # Calculated first, as the type of tristate symbols depends on it.
+        # The value gets cached, so MODULES is evaluated lazily below.
+        modules_val = self.modules.tri_value
+
+        for i, sc, conds, orig_tristate, defaults, weak_rev_dep, rev_dep, \
+            direct_dep in steps:
+
+            if conds is None:
+                # Choice, choice symbol, or MODULES. Use the regular
+                # evaluation, which finds the values of the items it depends
+                # on already cached.
+                vals[i] = sc.tri_value
+                continue
+
+            # Plain bool or tristate symbol. This mirrors Symbol.tri_value and
+            # _visibility().
+
+            if sc._cached_gen != gen:
+                sc._invalidate()
+
+            val = sc._cached_tri_val
+            if val is None:
+                # True if Symbol.type is TRISTATE
+                tristate = orig_tristate and modules_val
+
+                vis = sc._cached_vis
+                if vis is None:
+                    vis = 0
+                    for cond in conds:
+                        dep_val = cond(vals)
+                        if dep_val > vis:
+                            vis = dep_val
+
+                    if vis == 1 and not tristate:
+                        vis = 2
+
+                    sc._cached_vis = vis
+
+                write_to_conf = (vis != 0)
+                val = 0
+
+                if vis and sc.user_value is not None:
+                    val = min(sc.user_value, vis)
+
+                else:
+                    for default, cond in defaults:
+                        dep_val = cond(vals)
+                        if dep_val:
+                            val = min(default(vals), dep_val)
+                            if val:
+                                write_to_conf = True
+                            break
+
+                    dep_val = weak_rev_dep and weak_rev_dep(vals)
+                    if dep_val and direct_dep(vals):
+                        val = max(dep_val, val)
+                        write_to_conf = True
+
+                dep_val = rev_dep and rev_dep(vals)
+                if dep_val:
+                    if direct_dep(vals) < dep_val:
+                        sc._warn_select_unsatisfied_deps()
+
+                    val = max(dep_val, val)
+                    write_to_conf = True
+
+                if val == 1 and (not tristate or
+                                 weak_rev_dep and weak_rev_dep(vals) == 2):
+                    val = 2
+
+                sc._write_to_conf = write_to_conf
+                sc._cached_tri_val = val
+
+            vals[i] = val
+
+        return TriValues(index, vals)
+
     def unset_values(self):
         """
         Removes any user values from all symbols, as if Kconfig.load_config()
@@ -2154,9 +2616,12 @@ class Kconfig(object):
             rel_filename = filename
 
         self.kconfig_filenames.append(rel_filename)
+        if self._lazy_help:
+            self._help_stamps[rel_filename] = _file_stamp(filename)
 
         # The parent Kconfig files are represented as a list of
-        # (<include path>, <Python 'file' object for Kconfig file>) tuples.
+        # (<include path>, <readline() function for Kconfig file>,
+        #  <cached tokens for Kconfig file>) tuples.
         #
         # <include path> is immutable and holds a *tuple* of
         # (<filename>, <linenr>) tuples, giving the locations of the 'source'
@@ -2167,9 +2632,10 @@ class Kconfig(object):
         # to be assigned directly to MenuNode.include_path without having to
         # copy it, sharing it wherever possible.
 
-        # Save include path and 'file' object (via its 'readline' function)
-        # before entering the file
-        self._filestack.append((self._include_path, self._readline))
+        # Save include path, 'readline' function, and cached tokens before
+        # entering the file
+        self._filestack.append((self._include_path, self._readline,
+                                self._file_tokens))
 
         # _include_path is a tuple, so this rebinds the variable instead of
         # doing in-place modification
@@ -2186,8 +2652,11 @@ class Kconfig(object):
                             "\n".join("{}:{}".format(name, linenr)
                                       for name, linenr in self._include_path)))
 
+        # The whole file is read in at once, and then handed out line by line
+        # by self._readline(). Avoids lots of small reads on slow (e.g.
+        # network) filesystems.
         try:
-            self._readline = self._open(filename, "r").readline
+            lines = self._read_lines(filename)
         except EnvironmentError as e:
             # We already know that the file exists
             raise _KconfigIOError(
@@ -2195,19 +2664,81 @@ class Kconfig(object):
                    .format(self.filename, self.linenr, filename,
                            self._line.strip(),
                            errno.errorcode[e.errno], e.strerror))
+        except UnicodeDecodeError as e:
+            _decoding_error(e, rel_filename)
+
+        self._readline = _line_reader(lines)
+
+        if self._token_cache is not None:
+            self._file_tokens = \
+                self._token_cache.setdefault(_lines_hash(lines), {})
 
         self.filename = rel_filename
         self.linenr = 0
 
+        if self._shell_executor:
+            self._prefetch_stack.append(_prefetch_lines(lines))
+            self._prefetch_shell(0)
+
     def _leave_file(self):
         # Returns from a Kconfig file to the file that sourced it. See
         # _enter_file().
 
         # Restore location from parent Kconfig file
         self.filename, self.linenr = self._include_path[-1]
-        # Restore include path and 'file' object
-        self._readline.__self__.close()  # __self__ fetches the 'file' object
-        self._include_path, self._readline = self._filestack.pop()
+        # Restore include path, 'readline' function, and cached tokens
+        self._include_path, self._readline, self._file_tokens = \
+            self._filestack.pop()
+
+        if self._shell_executor:
+            self._prefetch_stack.pop()
+
+    def _glob(self, pattern):
+        # Returns a sorted list of the files that match the glob pattern
+        # 'pattern', reusing earlier results from the ParseCache, if any
+
+        if self._parse_cache is None:
+            return sorted(iglob(pattern))
+
+        globs = self._parse_cache.globs
+        if pattern not in globs:
+            globs[pattern] = sorted(iglob(pattern))
+        return globs[pattern]
+
+    def _read_lines(self, filename):
+        # Returns a list with the lines of 'filename', including newlines, as
+        # readline() would return them. The list is shared via the
+        # ParseCache, if any, and must not be modified.
+
+        if self._parse_cache is not None:
+            files = self._parse_cache.files
+            if filename not in files:
+                files[filename] = self._read_file_lines(filename)
+            return files[filename]
+
+        return self._read_file_lines(filename)
+
+    def _read_file_lines(self, filename):
+        # Helper for _read_lines(). Reads in the lines of 'filename'.
+
+        with self._open(filename, "r") as f:
+            contents = f.read()
+
+        lines = contents.splitlines(True)
+        if len(lines) != contents.count("\n") + \
+                (not contents.endswith("\n") and contents != ""):
+            # splitlines() also splits on other line boundaries than "\n"
+            # (e.g. form feeds) on Python 3, which readline() doesn't. These
+            # are rare, so handle them separately.
+            lines = [line + "\n" for line in contents.split("\n")]
+            if contents.endswith("\n"):
+                del lines[-1]
+            else:
+                lines[-1] = lines[-1][:-1]
+                if not lines[-1]:
+                    del lines[-1]
+
+        return lines
 
     def _next_line(self):
         # Fetches and tokenizes the next line from the current Kconfig file.
@@ -2234,7 +2765,12 @@ class Kconfig(object):
             line = line[:-2] + self._readline()
             self.linenr += 1
 
-        self._tokens = self._tokenize(line)
+        if self._file_tokens is not None:
+            self._tokens = self._tokenize_cached(line)
+        elif self._regex_tokenizer:
+            self._tokens = self._tokenize_regex(line)
+        else:
+            self._tokens = self._tokenize(line)
         # Initialize to 1 instead of 0 to factor out code from _parse_block()
         # and _parse_props(). They immediately fetch self._tokens[0].
         self._tokens_i = 1
@@ -2255,7 +2791,12 @@ class Kconfig(object):
             line = line[:-2] + self._readline()
             self.linenr += 1
 
-        self._tokens = self._tokenize(line)
+        if self._file_tokens is not None:
+            self._tokens = self._tokenize_cached(line)
+        elif self._regex_tokenizer:
+            self._tokens = self._tokenize_regex(line)
+        else:
+            self._tokens = self._tokenize(line)
         self._reuse_tokens = True
 
     def _write_if_changed(self, filename, contents):
@@ -2291,6 +2832,407 @@ class Kconfig(object):
             # notice it later
             return False
 
+    #
+    # Snapshots
+    #
+
+    def _snapshot_filename(self, filename, encoding, warn, skip_help,
+                           cache_dir):
+        # Returns the path to the snapshot file for the configuration. Things
+        # that are known before parsing go into the name, so that snapshots
+        # for e.g. different architectures can coexist in 'cache_dir'. The
+        # rest is checked by _snapshot_valid(). The slots of the pickled
+        # classes are included so that snapshots from a Kconfiglib with a
+        # different object layout are never loaded.
+
+        import hashlib  # Only import as needed, to save some startup time
+
+        key = repr((VERSION, sys.version_info[:2],
+                    [cls.__slots__ for cls in _SNAPSHOT_CLASSES],
+                    realpath(os.getenv("srctree", "")), filename, encoding,
+                    bool(warn), bool(skip_help),
+                    [os.getenv(name) for name in _SNAPSHOT_ENV_VARS]))
+
+        return join(cache_dir, "snapshot-{}.pickle".format(
+            hashlib.sha1(key.encode("utf-8")).hexdigest()))
+
+    def _save_snapshot(self, filename, encoding, cache_dir):
+        # Writes a snapshot of the parsed configuration to 'cache_dir'. See
+        # Kconfig.__init__().
+        #
+        # Symbols, choices, menu nodes, and variables reference each other
+        # heavily (e.g. through long chains of MenuNode.next pointers), so
+        # pickling the Kconfig instance directly would make pickle recurse
+        # through most of the object graph. Instead, all objects are first
+        # pickled as empty shells, and their slots are filled in by a second
+        # pass, where references to other objects turn into memo lookups. This
+        # keeps the recursion depth down to the nesting depth of expressions.
+
+        import copyreg  # Only import as needed, to save some startup time
+        import gc
+        import pickle
+
+        env = dict.fromkeys(self._unset_env_vars)
+        for name in self.env_vars:
+            env[name] = os.environ.get(name)
+        for sym in self.unique_defined_syms:
+            if sym.env_var is not None:
+                env[sym.env_var] = os.environ.get(sym.env_var)
+
+        objs = [self, self.top_node]
+        objs += self.syms.values()
+        objs += self.const_syms.values()
+        objs += self.unique_choices
+        objs += self.node_iter()
+        objs += self.variables.values()
+
+        # Set once the shells have been pickled. Any object we didn't find
+        # above would lose its state, so treat that as an error.
+        shells_done = []
+
+        def reduce_shell(obj):
+            if shells_done:
+                raise pickle.PicklingError(
+                    "unexpected {} object".format(obj.__class__.__name__))
+            return (copyreg.__newobj__, (obj.__class__,))
+
+        path = self._snapshot_filename(filename, encoding, self.warn,
+                                       self._discard_help, cache_dir)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            if not exists(cache_dir):
+                os.makedirs(cache_dir)
+
+            stamps = [(path_, _file_stamp(path_)) for path_ in
+                      _ordered_unique([join(self.srctree, name)
+                                       for name in self.kconfig_filenames])]
+
+            with open(tmp_path, "wb") as f:
+                pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+                pickler.dispatch_table = copyreg.dispatch_table.copy()
+                pickler.dispatch_table.update(
+                    dict.fromkeys(_SNAPSHOT_CLASSES, reduce_shell))
+
+                # The stamps of the compiler and linker, if $(shell) output
+                # went into the parsed configuration
+                pickler.dump((env, stamps, self._source_globs,
+                              _tool_stamps() if self._shell_used else None))
+                pickler.dump(objs)
+                shells_done.append(True)
+                pickler.dump([_SnapshotState(obj) for obj in objs])
+
+            os.replace(tmp_path, path)
+
+        except (EnvironmentError, pickle.PicklingError, RecursionError,
+                TypeError, AttributeError) as e:
+            # Failing to write the snapshot only costs time on the next run
+            self._warn("failed to write Kconfig snapshot to '{}': {}"
+                       .format(path, e))
+            try:
+                os.remove(tmp_path)
+            except EnvironmentError:
+                pass
+
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _load_snapshot(self, filename, warn, warn_to_stderr, encoding,
+                       skip_help, shell_cache, cache_dir):
+        # Initializes the Kconfig instance from a snapshot in 'cache_dir'.
+        # Returns True if a valid snapshot was loaded, and False otherwise, in
+        # which case the Kconfig files need to be parsed. See
+        # _save_snapshot() for the format.
+        #
+        # Snapshots hold the output of the $(shell) commands run while
+        # parsing. Without 'shell_cache', the commands are always run, so
+        # such snapshots are not used.
+
+        import gc  # Only import as needed, to save some startup time
+        import pickle
+
+        # Unpickling creates lots of container objects, which would trigger
+        # many pointless garbage collection passes
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(self._snapshot_filename(filename, encoding, warn,
+                                              skip_help, cache_dir),
+                      "rb") as f:
+                unpickler = pickle.Unpickler(f)
+                env, stamps, source_globs, tool_stamps = unpickler.load()
+                if (tool_stamps is not None and not shell_cache) or \
+                   not _snapshot_valid(env, stamps, source_globs,
+                                       tool_stamps):
+                    return False
+
+                objs = unpickler.load()
+                # Fills in the slots of the objects in 'objs'
+                unpickler.load()
+
+        except Exception:
+            # Missing, truncated, or otherwise unusable snapshot
+            return False
+
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        # The snapshot has its own Kconfig instance, which we take over. Point
+        # all references to it at us instead.
+        kconf = objs[0]
+        for name in self.__slots__:
+            if name not in _SNAPSHOT_SKIP_SLOTS:
+                setattr(self, name, getattr(kconf, name))
+
+        for obj in objs:
+            if getattr(obj, "kconfig", None) is kconf:
+                obj.kconfig = self
+
+        self.warn = warn
+        self.warn_to_stderr = warn_to_stderr
+        self._readline = None
+
+        # Report the warnings from parsing again, like a real parse would
+        if warn and warn_to_stderr:
+            for msg in self.warnings:
+                sys.stderr.write(msg + "\n")
+
+        return True
+
+    def _shell_cache_key(self):
+        # Returns a string that identifies the current toolchain. Everything
+        # that can change the output of $(shell) commands besides the command
+        # string itself goes into it.
+
+        import hashlib  # Only import as needed, to save some startup time
+
+        key = repr((VERSION, sys.version_info[:2], os.getcwd(),
+                    [os.getenv(name) for name in _SHELL_CACHE_ENV_VARS],
+                    _tool_stamps()))
+
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _shell_cache_filename(self, cache_dir):
+        # Returns the path to the $(shell) cache file for the current
+        # toolchain
+
+        return join(cache_dir,
+                    "shell-{}.pickle".format(self._shell_cache_key()))
+
+    def _load_shell_cache(self, cache_dir):
+        # Loads the cached $(shell) output for the current toolchain from the
+        # ParseCache or from 'cache_dir' (which might be None). A missing or
+        # broken cache file just gives an empty cache.
+
+        import pickle  # Only import as needed, to save some startup time
+
+        self._shell_cache_dirty = False
+
+        if self._parse_cache is not None:
+            shell_caches = self._parse_cache.shell
+            key = self._shell_cache_key()
+            if key in shell_caches:
+                self._shell_cache = shell_caches[key]
+                return
+
+        self._shell_cache = {}
+        if cache_dir is not None:
+            try:
+                with open(self._shell_cache_filename(cache_dir), "rb") as f:
+                    self._shell_cache = pickle.load(f)
+            except Exception:
+                pass
+            else:
+                if self._shell_cache.__class__ is not dict:
+                    self._shell_cache = {}
+
+        if self._parse_cache is not None:
+            shell_caches[key] = self._shell_cache
+
+    def _save_shell_cache(self, cache_dir):
+        # Writes the $(shell) cache back to 'cache_dir' if any commands were
+        # run while parsing
+
+        import pickle  # Only import as needed, to save some startup time
+
+        if not self._shell_cache_dirty:
+            return
+
+        path = self._shell_cache_filename(cache_dir)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            if not exists(cache_dir):
+                os.makedirs(cache_dir)
+
+            with open(tmp_path, "wb") as f:
+                pickle.dump(self._shell_cache, f, pickle.HIGHEST_PROTOCOL)
+
+            os.replace(tmp_path, path)
+
+        except EnvironmentError as e:
+            # Failing to write the cache only costs time on the next run
+            self._warn("failed to write $(shell) cache to '{}': {}"
+                       .format(path, e))
+            try:
+                os.remove(tmp_path)
+            except EnvironmentError:
+                pass
+
+    def _token_cache_filename(self, cache_dir):
+        # Returns the path to the token cache file. Tokens only depend on the
+        # contents of the Kconfig files (which are hashed separately) and on
+        # the Kconfiglib version.
+
+        import hashlib  # Only import as needed, to save some startup time
+
+        key = repr((VERSION, sys.version_info[:2]))
+
+        return join(cache_dir, "tokens-{}.pickle".format(
+            hashlib.sha1(key.encode("utf-8")).hexdigest()))
+
+    def _load_token_cache(self, cache_dir):
+        # Loads the cached tokens from the ParseCache or from 'cache_dir'
+        # (which might be None). A missing or broken cache file just gives an
+        # empty cache.
+
+        import pickle  # Only import as needed, to save some startup time
+
+        self._token_cache_dirty = False
+
+        if self._parse_cache is not None and \
+           self._parse_cache.tokens is not None:
+            self._token_cache = self._parse_cache.tokens
+            return
+
+        self._token_cache = {}
+        if cache_dir is not None:
+            try:
+                with open(self._token_cache_filename(cache_dir), "rb") as f:
+                    self._token_cache = pickle.load(f)
+            except Exception:
+                pass
+            else:
+                if self._token_cache.__class__ is not dict:
+                    self._token_cache = {}
+
+        if self._parse_cache is not None:
+            self._parse_cache.tokens = self._token_cache
+
+    def _save_token_cache(self, cache_dir):
+        # Writes the token cache back to 'cache_dir' if any lines were
+        # tokenized while parsing
+
+        import pickle  # Only import as needed, to save some startup time
+
+        if not self._token_cache_dirty:
+            return
+
+        # Share equal lines and cache entries between files. Kconfig files
+        # have lots of lines in common (e.g. 'bool' and 'help'), and pickle
+        # only stores shared objects once, which makes the cache much faster
+        # to load.
+        shared = {}
+        for key, file_tokens in self._token_cache.items():
+            self._token_cache[key] = {
+                shared.setdefault(line, line): shared.setdefault(entry, entry)
+                for line, entry in file_tokens.items()}
+
+        path = self._token_cache_filename(cache_dir)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            if not exists(cache_dir):
+                os.makedirs(cache_dir)
+
+            with open(tmp_path, "wb") as f:
+                pickle.dump(self._token_cache, f, pickle.HIGHEST_PROTOCOL)
+
+            os.replace(tmp_path, path)
+
+        except EnvironmentError as e:
+            # Failing to write the cache only costs time on the next run
+            self._warn("failed to write token cache to '{}': {}"
+                       .format(path, e))
+            try:
+                os.remove(tmp_path)
+            except EnvironmentError:
+                pass
+
+    def _prefetch_shell(self, linenr):
+        # Starts the $(shell) commands that will be run while parsing the
+        # current Kconfig file in the background, beginning after line
+        # 'linenr'. Stops at the next 'source' statement, which might change
+        # preprocessor variables. _shell_fn() picks up the output.
+        #
+        # Macros are expanded for real, but with scratch copies of the
+        # preprocessor variables, and with the functions replaced by stubs
+        # that record $(shell) commands. Output from stubs is represented by
+        # _PREFETCH_UNKNOWN, and commands that include it are not started.
+
+        lines = self._prefetch_stack[-1]
+        if linenr >= len(lines):
+            return
+
+        # Save the state that macro expansion might modify
+        variables = self.variables
+        functions = self._functions
+        env_vars = self.env_vars
+        unset_env_vars = self._unset_env_vars
+
+        self.variables = {name: _copy_variable(var)
+                          for name, var in variables.items()}
+        self._functions = {name: (_prefetch_unknown_fn, min_arg, max_arg)
+                           for name, (_, min_arg, max_arg)
+                           in functions.items()}
+        self._functions.update(_PREFETCH_FUNCTIONS)
+        self.env_vars = set(env_vars)
+        self._unset_env_vars = set(unset_env_vars)
+
+        try:
+            i = linenr
+            while i < len(lines):
+                line = lines[i]
+                i += 1
+                while line.endswith("\\\n") and i < len(lines):
+                    line = line[:-2] + lines[i]
+                    i += 1
+
+                match = _command_match(line)
+                if not match:
+                    continue
+
+                token = _get_keyword(match.group(1))
+                if token is _T_HELP or \
+                   (not token and line.strip(" \t\n-") == "help"):
+                    i = _skip_help(lines, i)
+                    continue
+
+                if "$(" in line:
+                    try:
+                        if not token:
+                            self._parse_assignment(line)
+                        elif "#" not in line and "\\" not in line:
+                            # Skip lines with comments and escapes, which
+                            # _expand_whole() doesn't know about
+                            self._expand_whole(line, ())
+                    except KconfigError:
+                        # Leave the error to the parser. Expansion might have
+                        # been aborted halfway.
+                        for var in self.variables.values():
+                            var._n_expansions = 0
+
+                if token in _SOURCE_TOKENS:
+                    break
+
+        finally:
+            self.variables = variables
+            self._functions = functions
+            self.env_vars = env_vars
+            self._unset_env_vars = unset_env_vars
+
     #
     # Tokenization
     #
@@ -2427,6 +3369,7 @@ class Kconfig(object):
                         self._warn("style: quotes recommended around '{}' in '{}'"
                                    .format(name, self._line.strip()),
                                    self.filename, self.linenr)
+                        self._line_warned = True
 
                     token = name
                     i = match.end()
@@ -2539,6 +3482,134 @@ class Kconfig(object):
 
         return tokens
 
+    def _tokenize_regex(self, s):
+        # Alternative to _tokenize() that returns the same tokens, used if
+        # Kconfig(regex_tokenizer=True). The tokens after the first one are
+        # found with a single findall() call, and the loop below only needs to
+        # look at which group matched.
+        #
+        # Lines that need more than that fall back on _tokenize(): Lines with
+        # macros or escapes, lines where the first token isn't a keyword
+        # (assignments, blank lines, etc.), and lines with something
+        # _tokens_findall() doesn't recognize (errors, unusual whitespace).
+        # The last case is detected before any symbols are looked up, so no
+        # symbols get registered and no warnings get generated twice.
+
+        if "$" in s or "\\" in s:
+            return self._tokenize(s)
+
+        match = _command_match(s)
+        if not match:
+            return self._tokenize(s)
+
+        token = _get_keyword(match.group(1))
+        if not token:
+            return self._tokenize(s)
+
+        matches = _tokens_findall(s, match.end())
+        if matches and matches[-1][3]:
+            # Unrecognized text
+            return self._tokenize(s)
+
+        self._line = s  # Used for error reporting
+
+        # As in _tokenize(), 'token' refers to the previous token while
+        # looking at a match
+        tokens = [token]
+        for name, string, operator, _ in matches:
+            if name:
+                keyword = _get_keyword(name)
+                if keyword:
+                    token = keyword
+
+                elif token not in _STRING_LEX:
+                    token = self.const_syms[name] if name in STR_TO_TRI else \
+                        self._lookup_sym(name)
+
+                else:
+                    # Missing quotes. See _tokenize().
+                    if token is not _T_CHOICE:
+                        self._warn("style: quotes recommended around '{}' in '{}'"
+                                   .format(name, self._line.strip()),
+                                   self.filename, self.linenr)
+                        self._line_warned = True
+
+                    token = name
+
+            elif string:
+                val = string[1:-1]
+                token = \
+                    val if token in _STRING_LEX or tokens[0] is _T_OPTION \
+                    else self._lookup_const_sym(val)
+
+            elif operator:
+                token = _OPERATOR_TOKENS[operator]
+
+            else:
+                # Comment
+                break
+
+            tokens.append(token)
+
+        tokens.append(None)
+
+        return tokens
+
+    def _tokenize_cached(self, s):
+        # Returns the tokens for 's', taken from the cached tokens for the
+        # current Kconfig file if possible. Otherwise, 's' is tokenized and
+        # the tokens are added to the cache. Used with Kconfig(token_cache=True)
+        # if 'cache_dir' or 'parse_cache' is passed.
+        #
+        # The cache maps lines to (<tokens>, <symbols>) tuples. Symbols are
+        # stored by name, as a tuple of (<index>, <name>, <is constant>)
+        # tuples, with None at their indices in <tokens>. They're looked up in
+        # the same order as the tokenizer would look them up, so that new
+        # symbols get registered in the same order. Tokens without symbols are
+        # used as is, which is safe as token lists are never modified.
+
+        entry = self._file_tokens.get(s)
+        if entry:
+            self._line = s  # Used for error reporting
+
+            tokens, syms = entry
+            if syms:
+                tokens = list(tokens)
+                sym_table = self.syms
+                for i, name, is_const in syms:
+                    if is_const:
+                        tokens[i] = self._lookup_const_sym(name)
+                    elif name in sym_table:
+                        tokens[i] = sym_table[name]
+                    else:
+                        tokens[i] = self._lookup_sym(name)
+            return tokens
+
+        self._line_warned = False
+        tokens = self._tokenize_regex(s) if self._regex_tokenizer \
+            else self._tokenize(s)
+
+        # Lines with macros are skipped, as they might expand differently
+        # later, and so are preprocessor variable assignments, which have side
+        # effects. Lines that generated warnings are skipped too, so that the
+        # warnings aren't lost.
+        if "$" in s or self._line_warned or \
+           (tokens[0] is None and
+            not (s.isspace() or s.lstrip().startswith("#"))):
+            return tokens
+
+        cached = list(tokens)
+        syms = []
+        for i, token in enumerate(tokens):
+            if token.__class__ is Symbol:
+                syms.append((i, token.name, token.is_constant))
+                cached[i] = None
+
+        self._file_tokens[s] = (tuple(cached), tuple(syms))
+        self._token_cache_dirty = True
+
+        return tokens
+
     # Helpers for syntax checking and token fetching. See the
     # 'Intro to expressions' section for what a constant symbol is.
     #
@@ -2855,6 +3926,7 @@ class Kconfig(object):
             self.env_vars.add(fn)
             return os.environ[fn]
 
+        self._unset_env_vars.add(fn)
         return ""
 
     #
@@ -2873,7 +3945,7 @@ class Kconfig(object):
         if e1 is self.n or e2 is self.n:
             return self.n
 
-        return (AND, e1, e2)
+        return self._intern_expr(AND, e1, e2)
 
     def _make_or(self, e1, e2):
         # Constructs an OR (||) expression. Performs trivial simplification.
@@ -2887,7 +3959,32 @@ class Kconfig(object):
         if e1 is self.y or e2 is self.y:
             return self.y
 
-        return (OR, e1, e2)
+        return self._intern_expr(OR, e1, e2)
+
+    def _intern_expr(self, op, e1, e2=None):
+        # Returns the expression (op, e1, e2), or (op, e1) if 'e2' is None.
+        #
+        # Expressions are hash-consed: Since the operands have already been
+        # interned (symbols are unique anyway), the identities of the
+        # operands identify the expression, and structurally identical
+        # expressions end up as the same tuple. Kconfig files repeat a lot of
+        # dependencies (e.g. within 'if' blocks and menus), so this saves
+        # memory, and tools can reuse evaluation results for identical
+        # expressions by checking identity.
+        #
+        # Interning is only done while the Kconfig files are parsed. See the
+        # end of _init().
+
+        if self._exprs is None:
+            return (op, e1) if e2 is None else (op, e1, e2)
+
+        key = (op, id(e1), id(e2))
+        expr = self._exprs.get(key)
+        if expr is None:
+            expr = self._exprs[key] = \
+                (op, e1) if e2 is None else (op, e1, e2)
+
+        return expr
 
     def _parse_block(self, end_token, parent, prev):
         # Parses a block, which is the contents of either a file or an if,
@@ -2973,7 +4070,9 @@ class Kconfig(object):
                 # - Sort the glob results to ensure a consistent ordering of
                 #   Kconfig symbols, which indirectly ensures a consistent
                 #   ordering in e.g. .config files
-                filenames = sorted(iglob(join(self._srctree_prefix, pattern)))
+                glob_pattern = join(self._srctree_prefix, pattern)
+                filenames = self._glob(glob_pattern)
+                self._source_globs.append((glob_pattern, filenames))
 
                 if not filenames and t0 in _OBL_SOURCE_TOKENS:
                     raise KconfigError(
@@ -2991,6 +4090,10 @@ class Kconfig(object):
                     prev = self._parse_block(None, parent, prev)
                     self._leave_file()
 
+                if self._shell_executor:
+                    # Continue looking for $(shell) calls after the 'source'
+                    self._prefetch_shell(self.linenr)
+
             elif t0 is end_token:
                 # Reached the end of the block. Terminate the final node and
                 # return it.
@@ -3333,13 +4436,16 @@ class Kconfig(object):
         node.prompt = (prompt, self._parse_cond())
 
     def _parse_help(self, node):
-        if node.help is not None:
+        if node._help is not None:
             self._warn(node.item.name_and_loc + " defined with more than "
                        "one help text -- only the last one will be used")
 
         # Micro-optimization. This code is pretty hot.
         readline = self._readline
 
+        # Location of the 'help' line, for _load_help()
+        help_loc = (self.filename, self.linenr)
+
         # Find first non-blank (not all-space) line and get its
         # indentation
 
@@ -3363,6 +4469,17 @@ class Kconfig(object):
             self._empty_help(node, line)
             return
 
+        if self._discard_help:
+            self._skip_help(line, indent)
+            return
+
+        if self._lazy_help:
+            # Remember where the help text is. It is read in by _load_help()
+            # when MenuNode.help is accessed.
+            node._help = help_loc
+            self._skip_help(line, indent)
+            return
+
         # The help text goes on till the first non-blank line with less indent
         # than the first line
 
@@ -3389,6 +4506,84 @@ class Kconfig(object):
         if line:
             self._line_after_help(line)
 
+    def _skip_help(self, line, indent):
+        # Skips past a help text without storing it. 'line' is the first line
+        # of the help text, and 'indent' its indentation. Keeps the line
+        # number up to date.
+        #
+        # Lines that begin with the same whitespace as the first line are
+        # always part of the help text, so the indentation only needs to be
+        # calculated for other lines. Saves an expandtabs() per line.
+
+        readline = self._readline
+        prefix = line[:len(line) - len(line.lstrip())]
+
+        n_lines = 1
+        while 1:
+            line = readline()
+            if line.startswith(prefix) or line.isspace():
+                n_lines += 1
+            elif not line or _indentation(line) < indent:
+                break
+            else:
+                n_lines += 1
+
+        # _parse_help() counts the first line twice, and the line after the
+        # help text not at all. Do the same here.
+        self.linenr += n_lines
+        if line:
+            self._line_after_help(line)
+
+    def _load_help(self, filename, linenr):
+        # Reads in a help text that was skipped during parsing, for
+        # MenuNode.help. 'linenr' is the line number of the 'help' keyword in
+        # 'filename'. See _parse_help().
+        #
+        # The lines of the file are kept in the ParseCache, if any, or in
+        # _help_lines, so that each file is only read once. When read from
+        # disk, the file must be unchanged since it was parsed.
+
+        path = join(self.srctree, filename)
+        if self._parse_cache is not None:
+            file_lines = self._read_lines(path)
+        else:
+            file_lines = self._help_lines.get(path)
+            if file_lines is None:
+                stamp = self._help_stamps.get(filename)
+                try:
+                    if stamp is not None and _file_stamp(path) != stamp:
+                        file_lines = ()
+                    else:
+                        file_lines = self._read_file_lines(path)
+                except EnvironmentError:
+                    file_lines = ()
+                self._help_lines[path] = file_lines
+
+        if not file_lines:
+            self._warn("'{}' was modified or removed after it was parsed. "
+                       "The help text at line {} is not available."
+                       .format(filename, linenr))
+            return ""
+
+        i = linenr
+        while file_lines[i].isspace():
+            i += 1
+
+        expline = file_lines[i].expandtabs()
+        indent = len(expline) - len(expline.lstrip())
+        lines = [expline[indent:]]
+
+        for line in file_lines[i + 1:]:
+            if line.isspace():
+                lines.append("\n")
+            else:
+                expline = line.expandtabs()
+                if len(expline) - len(expline.lstrip()) < indent:
+                    break
+                lines.append(expline[indent:])
+
+        return "".join(lines).rstrip()
+
     def _empty_help(self, node, line):
         self._warn(node.item.name_and_loc +
                    " has 'help' but empty help text")
@@ -3435,7 +4630,7 @@ class Kconfig(object):
         # Otherwise, parse the expression on the right and make an OR node.
         # This turns A || B || C || D into (OR, A, (OR, B, (OR, C, D))).
         return and_expr if not self._check_token(_T_OR) else \
-            (OR, and_expr, self._parse_expr(transform_m))
+            self._intern_expr(OR, and_expr, self._parse_expr(transform_m))
 
     def _parse_and_expr(self, transform_m):
         factor = self._parse_factor(transform_m)
@@ -3444,7 +4639,8 @@ class Kconfig(object):
         # Otherwise, parse the right operand and make an AND node. This turns
         # A && B && C && D into (AND, A, (AND, B, (AND, C, D))).
         return factor if not self._check_token(_T_AND) else \
-            (AND, factor, self._parse_and_expr(transform_m))
+            self._intern_expr(AND, factor,
+                              self._parse_and_expr(transform_m))
 
     def _parse_factor(self, transform_m):
         token = self._tokens[self._tokens_i]
@@ -3459,7 +4655,7 @@ class Kconfig(object):
                 # For conditional expressions ('depends on <expr>',
                 # '... if <expr>', etc.), m is rewritten to m && MODULES.
                 if transform_m and token is self.m:
-                    return (AND, self.m, self.modules)
+                    return self._intern_expr(AND, self.m, self.modules)
 
                 return token
 
@@ -3468,12 +4664,12 @@ class Kconfig(object):
             # _T_EQUAL, _T_UNEQUAL, etc., deliberately have the same values as
             # EQUAL, UNEQUAL, etc., so we can just use the token directly
             self._tokens_i += 1
-            return (self._tokens[self._tokens_i - 1], token,
-                    self._expect_sym())
+            return self._intern_expr(self._tokens[self._tokens_i - 1], token,
+                                     self._expect_sym())
 
         if token is _T_NOT:
             # token == _T_NOT == NOT
-            return (token, self._parse_factor(transform_m))
+            return self._intern_expr(token, self._parse_factor(transform_m))
 
         if token is _T_OPEN_PAREN:
             expr_parse = self._parse_expr(transform_m)
@@ -3561,15 +4757,115 @@ class Kconfig(object):
             for sym in choice.syms:
                 sym._dependents.add(choice)
 
-    def _invalidate_all(self):
-        # Undefined symbols never change value and don't need to be
-        # invalidated, so we can just iterate over defined symbols.
-        # Invalidating constant symbols would break things horribly.
+    def _build_tri_plan(self):
+        # tri_values() helper. Returns an (index, steps) tuple. 'index' maps
+        # each defined bool/tristate symbol and each choice to its index in
+        # the value array, and 'steps' has a tuple for each of them, in index
+        # order, that says how to evaluate it.
+        #
+        # The order is topological, derived from the _dependents sets. Each
+        # choice is grouped with its symbols, which removes the
+        # <choice symbol> <-> <choice> loops from _add_choice_deps(). Items
+        # in groups are evaluated lazily, as are items that somehow end up in
+        # a loop anyway.
+
+        # Maps each item to the first item in its group
+        group_of = {}
+        groups = []
+        members = {}
+
         for sym in self.unique_defined_syms:
-            sym._invalidate()
+            if not sym.choice:
+                group_of[sym] = sym
+                groups.append(sym)
+                members[sym] = (sym,)
 
         for choice in self.unique_choices:
-            choice._invalidate()
+            for sc in choice.syms:
+                group_of[sc] = choice
+            group_of[choice] = choice
+            groups.append(choice)
+            members[choice] = [choice] + choice.syms
+
+        succs = {group: [] for group in groups}
+        n_preds = dict.fromkeys(groups, 0)
+        for sc, group in group_of.items():
+            for dependent in sc._dependents:
+                dep_group = group_of[dependent]
+                if dep_group is not group:
+                    succs[group].append(dep_group)
+                    n_preds[dep_group] += 1
+
+        # Sort by the length of the longest dependency path leading to each
+        # group, which is a topological order. Ties keep definition order,
+        # so that e.g. warnings come out in the same order each time.
+        level = dict.fromkeys(groups, 0)
+        todo = [group for group in groups if not n_preds[group]]
+        for group in todo:
+            for dep_group in succs[group]:
+                if level[dep_group] <= level[group]:
+                    level[dep_group] = level[group] + 1
+
+                n_preds[dep_group] -= 1
+                if not n_preds[dep_group]:
+                    todo.append(dep_group)
+
+        # Groups that were never reached are in a loop and go last
+        in_loop = set(groups).difference(todo)
+        for group in in_loop:
+            level[group] = len(groups)
+
+        order = []
+        for group in sorted(groups, key=level.__getitem__):
+            for sc in members[group]:
+                if sc.__class__ is Choice or sc.orig_type in _BOOL_TRISTATE:
+                    order.append(sc)
+
+        index = {sc: i for i, sc in enumerate(order)}
+
+        # Many symbols share expressions, e.g. the dependencies from an
+        # enclosing menu, and n/y for missing properties. Compile each
+        # expression once. The expressions stay alive, so their id()s are
+        # unique.
+        funcs = {}
+
+        def compile_expr(expr):
+            func = funcs.get(id(expr))
+            if not func:
+                func = funcs[id(expr)] = _expr_compile(expr, index)
+            return func
+
+        steps = []
+        for i, sc in enumerate(order):
+            if sc.__class__ is Choice or sc.choice or \
+               sc is self.modules or sc in in_loop:
+
+                steps.append((i, sc, None, None, None, None, None, None))
+
+            else:
+                steps.append((
+                    i, sc,
+                    tuple([compile_expr(node.prompt[1])
+                           for node in sc.nodes if node.prompt]),
+                    sc.orig_type is TRISTATE,
+                    tuple([(compile_expr(default), compile_expr(cond))
+                           for default, cond in sc.defaults]),
+                    # Most symbols aren't selected or implied. None saves a
+                    # function call for them.
+                    None if sc.weak_rev_dep is self.n else
+                        compile_expr(sc.weak_rev_dep),
+                    None if sc.rev_dep is self.n else
+                        compile_expr(sc.rev_dep),
+                    compile_expr(sc.direct_dep)))
+
+        return index, steps
+
+    def _invalidate_all(self):
+        # Invalidates all symbols and choices in O(1) time, by starting a new
+        # generation. Cached values are stamped with the generation they were
+        # calculated in, and values from earlier generations get recalculated
+        # when they're next accessed. See Symbol._invalidate().
+        self._generation += 1
 
     #
     # Post-parsing menu tree processing, including dependency propagation and
@@ -4263,6 +5559,7 @@ class Symbol(object):
     """
     __slots__ = (
         "_cached_assignable",
+        "_cached_gen",
         "_cached_str_val",
         "_cached_tri_val",
         "_cached_vis",
@@ -4311,6 +5608,9 @@ class Symbol(object):
         """
         See the class documentation.
         """
+        if self._cached_gen != self.kconfig._generation:
+            self._invalidate()
+
         if self._cached_str_val is not None:
             return self._cached_str_val
 
@@ -4452,6 +5752,9 @@ class Symbol(object):
         """
         See the class documentation.
         """
+        if self._cached_gen != self.kconfig._generation:
+            self._invalidate()
+
         if self._cached_tri_val is not None:
             return self._cached_tri_val
 
@@ -4532,6 +5835,9 @@ class Symbol(object):
         """
         See the class documentation.
         """
+        if self._cached_gen != self.kconfig._generation:
+            self._invalidate()
+
         if self._cached_assignable is None:
             self._cached_assignable = self._assignable()
         return self._cached_assignable
@@ -4541,6 +5847,9 @@ class Symbol(object):
         """
         See the class documentation.
         """
+        if self._cached_gen != self.kconfig._generation:
+            self._invalidate()
+
         if self._cached_vis is None:
             self._cached_vis = _visibility(self)
         return self._cached_vis
@@ -4823,6 +6132,9 @@ class Symbol(object):
         self._cached_str_val = self._cached_tri_val = self._cached_vis = \
         self._cached_assignable = None
 
+        # Generation of the cached values. See Kconfig._invalidate_all().
+        self._cached_gen = 0
+
         # _write_to_conf is calculated along with the value. If True, the
         # Symbol gets a .config entry.
 
@@ -4880,41 +6192,30 @@ class Symbol(object):
         return (1,)
 
     def _invalidate(self):
-        # Marks the symbol as needing to be recalculated
+        # Marks the symbol as needing to be recalculated. Also moves it to the
+        # current generation (see Kconfig._invalidate_all()).
 
-        self._cached_str_val = self._cached_tri_val = self._cached_vis = \
-        self._cached_assignable = None
+        self._cached_gen = self.kconfig._generation
+
+        # Constant symbols never change value. Invalidating them would break
+        # things horribly.
+        if not self.is_constant:
+            self._cached_str_val = self._cached_tri_val = self._cached_vis = \
+            self._cached_assignable = None
 
     def _rec_invalidate(self):
         # Invalidates the symbol and all items that (possibly) depend on it
 
-        if self is self.kconfig.modules:
+        if self.kconfig._batch_depth:
+            # Within Kconfig.batch(). Everything gets invalidated when the
+            # batch ends.
+            self.kconfig._batch_invalidate = True
+        elif self is self.kconfig.modules:
             # Invalidating MODULES has wide-ranging effects
             self.kconfig._invalidate_all()
         else:
             self._invalidate()
-
-            for item in self._dependents:
-                # _cached_vis doubles as a flag that tells us whether 'item'
-                # has cached values, because it's calculated as a side effect
-                # of calculating all other (non-constant) cached values.
-                #
-                # If item._cached_vis is None, it means there can't be cached
-                # values on other items that depend on 'item', because if there
-                # were, some value on 'item' would have been calculated and
-                # item._cached_vis set as a side effect. It's therefore safe to
-                # stop the invalidation at symbols with _cached_vis None.
-                #
-                # This approach massively speeds up scripts that set a lot of
-                # values, vs simply invalidating all possibly dependent symbols
-                # (even when you already have a list of all the dependent
-                # symbols, because some symbols get huge dependency trees).
-                #
-                # This gracefully handles dependency loops too, which is nice
-                # for choices, where the choice depends on the choice symbols
-                # and vice versa.
-                if item._cached_vis is not None:
-                    item._rec_invalidate()
+            _invalidate_dependents(self)
 
     def _rec_invalidate_if_has_prompt(self):
         # Invalidates the symbol and its dependent symbols, but only if the
@@ -5171,6 +6472,7 @@ class Choice(object):
     """
     __slots__ = (
         "_cached_assignable",
+        "_cached_gen",
         "_cached_selection",
         "_cached_vis",
         "_dependents",
@@ -5234,6 +6536,9 @@ class Choice(object):
         """
         See the class documentation.
         """
+        if self._cached_gen != self.kconfig._generation:
+            self._invalidate()
+
         if self._cached_assignable is None:
             self._cached_assignable = self._assignable()
         return self._cached_assignable
@@ -5243,6 +6548,9 @@ class Choice(object):
         """
         See the class documentation.
         """
+        if self._cached_gen != self.kconfig._generation:
+            self._invalidate()
+
         if self._cached_vis is None:
             self._cached_vis = _visibility(self)
         return self._cached_vis
@@ -5260,6 +6568,9 @@ class Choice(object):
         """
         See the class documentation.
         """
+        if self._cached_gen != self.kconfig._generation:
+            self._invalidate()
+
         if self._cached_selection is _NO_CACHED_SELECTION:
             self._cached_selection = self._selection()
         return self._cached_selection
@@ -5417,6 +6728,7 @@ class Choice(object):
         self._cached_vis = self._cached_assignable = None
 
         self._cached_selection = _NO_CACHED_SELECTION
+        self._cached_gen = 0
 
         # is_constant is checked by _depend_on(). Just set it to avoid having
         # to special-case choices.
@@ -5476,17 +6788,19 @@ class Choice(object):
         return None
 
     def _invalidate(self):
+        self._cached_gen = self.kconfig._generation
         self._cached_vis = self._cached_assignable = None
         self._cached_selection = _NO_CACHED_SELECTION
 
     def _rec_invalidate(self):
         # See Symbol._rec_invalidate()
 
-        self._invalidate()
+        if self.kconfig._batch_depth:
+            self.kconfig._batch_invalidate = True
+            return
 
-        for item in self._dependents:
-            if item._cached_vis is not None:
-                item._rec_invalidate()
+        self._invalidate()
+        _invalidate_dependents(self)
 
 
 class MenuNode(object):
@@ -5632,9 +6946,9 @@ class MenuNode(object):
       The Kconfig instance the menu node is from.
     """
     __slots__ = (
+        "_help",
         "dep",
         "filename",
-        "help",
         "include_path",
         "is_menuconfig",
         "item",
@@ -5663,6 +6977,21 @@ class MenuNode(object):
         self.implies = []
         self.ranges = []
 
+    @property
+    def help(self):
+        """
+        See the class documentation.
+        """
+        help = self._help
+        if help.__class__ is tuple:
+            # Help text skipped during parsing. See Kconfig(lazy_help=True).
+            help = self._help = self.kconfig._load_help(*help)
+        return help
+
+    @help.setter
+    def help(self, help):
+        self._help = help
+
     @property
     def orig_prompt(self):
         """
@@ -5773,7 +7102,7 @@ class MenuNode(object):
         if self.item is MENU:
             add("'visible if' deps " + TRI_TO_STR[expr_value(self.visibility)])
 
-        if self.item.__class__ in _SYMBOL_CHOICE and self.help is not None:
+        if self.item.__class__ in _SYMBOL_CHOICE and self._help is not None:
             add("has help")
 
         if self.list:
@@ -5973,6 +7302,100 @@ class Variable(object):
                        self.value)
 
 
+class ParseCache(object):
+    """
+    Holds parsing work that can be shared between Kconfig instances created
+    in the same process, passed to them via Kconfig(parse_cache=...). This
+    speeds up e.g. parsing the same kernel tree for several architectures, as
+    most Kconfig files are the same for all of them.
+
+    The Kconfig files must not be modified while a ParseCache is in use, as
+    their contents are only read in once.
+
+    The following attributes are available. They should be viewed as
+    read-only.
+
+    files:
+      A dictionary that maps Kconfig filenames to lists with their lines.
+
+    globs:
+      A dictionary that maps the glob patterns of 'source' statements (with
+      $srctree prepended) to sorted lists of matching filenames.
+
+    shell:
+      A dictionary that maps strings that identify toolchains (see
+      Kconfig(shell_cache=...)) to dictionaries with cached $(shell) output.
+      Kconfig instances using different toolchains do not share $(shell)
+      output.
+
+    tokens:
+      The cache of tokenized lines (see Kconfig(token_cache=...)), or None if
+      no Kconfig instance has used it yet.
+    """
+    __slots__ = (
+        "files",
+        "globs",
+        "shell",
+        "tokens",
+    )
+
+    def __init__(self):
+        """
+        Creates a new, empty ParseCache.
+        """
+        self.files = {}
+        self.globs = {}
+        self.shell = {}
+        self.tokens = None
+
+    def __repr__(self):
+        return "<parse cache, {} files, {} globs, {} toolchains>" \
+               .format(len(self.files), len(self.globs), len(self.shell))
+
+
+class TriValues(object):
+    """
+    Holds the tristate values of all defined bool and tristate symbols and
+    all choices, as returned by Kconfig.tri_values(). The values reflect the
+    configuration at the time of the call.
+
+    tri_values[sc] gives the value of the symbol or choice 'sc' (0, 1, or 2
+    for n, m, and y), like sc.tri_value. Other symbols (e.g. constant,
+    undefined, or int symbols) fall back on sc.tri_value.
+
+    The following attributes are available. They should be viewed as
+    read-only.
+
+    index:
+      A dictionary that maps each defined bool/tristate symbol and each
+      choice to its index in 'values'. Items come after the items they depend
+      on. The dictionary is shared between all TriValues instances from a
+      Kconfig instance.
+
+    values:
+      An array('b') with the values of the items in 'index'.
+    """
+    __slots__ = (
+        "index",
+        "values",
+    )
+
+    def __init__(self, index, values):
+        self.index = index
+        self.values = values
+
+    def __getitem__(self, sc):
+        i = self.index.get(sc)
+        return sc.tri_value if i is None else self.values[i]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return "<tristate values for {} symbols and choices>" \
+               .format(len(self.values))
+
+
 class KconfigError(Exception):
     """
     Exception raised for Kconfig-related errors.
@@ -6004,6 +7427,28 @@ class _KconfigIOError(IOError):
         return self.msg
 
 
+class _Batch(object):
+    # Context manager returned by Kconfig.batch()
+
+    __slots__ = ("kconfig",)
+
+    def __init__(self, kconfig):
+        self.kconfig = kconfig
+
+    def __enter__(self):
+        self.kconfig._batch_depth += 1
+        return self.kconfig
+
+    def __exit__(self, *_):
+        kconf = self.kconfig
+        kconf._batch_depth -= 1
+        # Invalidate even if an exception was raised, as some values might
+        # have been set already
+        if not kconf._batch_depth and kconf._batch_invalidate:
+            kconf._batch_invalidate = False
+            kconf._invalidate_all()
+
+
 #
 # Public functions
 #
@@ -6066,6 +7511,25 @@ def expr_value(expr):
               comp >= 0)
 
 
+def expr_compile(expr):
+    """
+    Returns a function that evaluates the expression 'expr' when called with
+    no arguments. The function returns the same value as expr_value(expr)
+    would, including short-circuiting, but avoids re-interpreting the
+    expression tuples on each call. This pays off for expressions that get
+    evaluated many times, e.g. once per configuration when going through
+    many configurations.
+
+    Python code is generated once per distinct expression structure, ignoring
+    which symbols appear in it, and shared between expressions, so compiling
+    an expression is cheap. Expressions nested too deeply to compile are
+    evaluated with expr_value() by the returned function.
+
+    'expr' must be an already-parsed expression, like for expr_value().
+    """
+    return _expr_compile(expr, None)
+
+
 def standard_sc_expr_str(sc):
     """
     Standard symbol/choice printing function. Uses plain Kconfig syntax, and
@@ -6302,6 +7766,23 @@ def load_allconfig(kconf, filename):
     kconf.warn_assign_redun = old_warn_assign_redun
 
 
+def purge_cache(cache_dir):
+    """
+    Removes all Kconfig snapshots, cached $(shell) output, and cached tokens
+    from 'cache_dir', as written when passing 'cache_dir' to
+    Kconfig.__init__(). Other files in the directory are left alone. Does
+    nothing if 'cache_dir' doesn't exist.
+    """
+    if not exists(cache_dir):
+        return
+
+    for name in os.listdir(cache_dir):
+        # Also catches temporary files left behind by interrupted writes
+        if name.startswith(("snapshot-", "shell-", "tokens-")) and \
+           name.endswith((".pickle", ".tmp")):
+            os.remove(join(cache_dir, name))
+
+
 #
 # Internal functions
 #
@@ -6388,6 +7869,131 @@ def _strcmp(s1, s2):
     return (s1 > s2) - (s1 < s2)
 
 
+def _expr_compile(expr, index):
+    # Implements expr_compile(). If 'index' is given, the values of the
+    # symbols and choices in it are read from the array passed to the
+    # returned function instead (see _expr_shape()).
+
+    operands = []
+    shape = _expr_shape(expr, operands, 0, index)
+    if shape is None:
+        return lambda a=None: expr_value(expr)
+
+    factory = _expr_factories.get(shape)
+    if not factory:
+        factory = _expr_factories[shape] = _expr_factory(shape)
+
+    return factory(operands)
+
+
+def _expr_shape(expr, operands, depth, index=None):
+    # expr_compile() helper. Returns the structure of 'expr' with the operands
+    # left out, appending the operands to 'operands' in evaluation order.
+    # Symbols and choices are represented by 0 and relations by 1 in the
+    # structure. Returns None if 'expr' is nested too deeply to compile.
+    #
+    # If 'index' is given, symbols and choices in it are represented by 2
+    # instead, with their index as the operand. Their values are read from
+    # the array passed to the generated function (see Kconfig.tri_values()).
+
+    if expr.__class__ is not tuple:
+        if index is not None and expr in index:
+            operands.append(index[expr])
+            return 2
+
+        operands.append(expr)
+        return 0
+
+    if expr[0] is AND or expr[0] is OR:
+        if depth == _EXPR_COMPILE_MAX_DEPTH:
+            return None
+
+        shape1 = _expr_shape(expr[1], operands, depth + 1, index)
+        if shape1 is None:
+            return None
+
+        shape2 = _expr_shape(expr[2], operands, depth + 1, index)
+        if shape2 is None:
+            return None
+
+        return (expr[0], shape1, shape2)
+
+    if expr[0] is NOT:
+        shape1 = _expr_shape(expr[1], operands, depth, index)
+        return None if shape1 is None else (NOT, shape1)
+
+    # Relation
+    operands.append(expr)
+    return 1
+
+
+def _expr_factory(shape):
+    # expr_compile() helper. Generates a function that takes the operands of
+    # an expression with the structure 'shape' (see _expr_shape()) and returns
+    # a function that evaluates the expression. The generated code does the
+    # same thing as expr_value(), with AND/OR/NOT inlined. The function takes
+    # the array to read indexed operands from as its optional argument.
+
+    lines = []
+    # Number of operands and temporary variables
+    counts = [0, 0]
+
+    def gen(shape, var, indent):
+        # Adds code that stores the value of 'shape' in 'var'
+
+        if shape == 0:
+            lines.append("{}{} = o{}.tri_value"
+                         .format(indent, var, counts[0]))
+            counts[0] += 1
+
+        elif shape == 1:
+            lines.append("{}{} = expr_value(o{})"
+                         .format(indent, var, counts[0]))
+            counts[0] += 1
+
+        elif shape == 2:
+            lines.append("{}{} = a[o{}]".format(indent, var, counts[0]))
+            counts[0] += 1
+
+        elif shape[0] is NOT:
+            gen(shape[1], var, indent)
+            lines.append("{0}{1} = 2 - {1}".format(indent, var))
+
+        else:
+            gen(shape[1], var, indent)
+
+            counts[1] += 1
+            var2 = "v{}".format(counts[1])
+
+            if shape[0] is AND:
+                # Short-circuit the n case, like expr_value()
+                lines.append("{}if {}:".format(indent, var))
+                gen(shape[2], var2, indent + " ")
+                lines.append("{0} if {1} < {2}: {2} = {1}"
+                             .format(indent, var2, var))
+            else:
+                # Short-circuit the y case, like expr_value()
+                lines.append("{}if {} != 2:".format(indent, var))
+                gen(shape[2], var2, indent + " ")
+                lines.append("{0} if {1} > {2}: {2} = {1}"
+                             .format(indent, var2, var))
+
+    gen(shape, "v0", "  ")
+
+    namespace = {"expr_value": expr_value}
+    exec("def factory(o):\n"
+         " {}, = o\n"
+         " def f(a=None):\n"
+         "{}\n"
+         "  return v0\n"
+         " return f\n"
+         .format(", ".join("o{}".format(i) for i in range(counts[0])),
+                 "\n".join(lines)),
+         namespace)
+
+    return namespace["factory"]
+
+
 def _sym_to_num(sym):
     # expr_value() helper for converting a symbol to a number. Raises
     # ValueError for symbols that can't be converted.
@@ -6738,6 +8344,214 @@ def _found_dep_loop(loop, cur):
     raise KconfigError(msg)
 
 
+def _file_stamp(path):
+    # Returns a value that changes when the file at 'path' is modified. Used
+    # to check if snapshots are still valid.
+
+    st = os.stat(path)
+    return (st.st_mtime, st.st_size)
+
+
+def _indentation(line):
+    # Returns the indentation of 'line', with tabs expanded. Used to skip help
+    # texts.
+
+    whitespace = line[:len(line) - len(line.lstrip())]
+    return len(whitespace.expandtabs()) if "\t" in whitespace else \
+        len(whitespace)
+
+
+def _line_reader(lines):
+    # Returns a function that returns the next line from 'lines' each time
+    # it's called, and "" at the end, like the readline() method of a file.
+    # Used by Kconfig._readline.
+
+    return partial(next, iter(lines), "")
+
+
+def _prefetch_lines(lines):
+    # Returns the Kconfig file lines 'lines' for Kconfig._prefetch_shell().
+    # Files without macros (most of them) give an empty list, as there's
+    # nothing to look for.
+
+    for line in lines:
+        if "$(" in line:
+            return lines
+    return []
+
+
+def _copy_variable(var):
+    # Returns a copy of the preprocessor Variable 'var'. Used by
+    # Kconfig._prefetch_shell().
+
+    copy = Variable()
+    copy.kconfig = var.kconfig
+    copy.name = var.name
+    copy.value = var.value
+    copy.is_recursive = var.is_recursive
+    copy._n_expansions = 0
+    return copy
+
+
+def _skip_help(lines, i):
+    # Returns the index of the first line after the help text that starts at
+    # lines[i]. Mirrors Kconfig._parse_help(). Used by Kconfig._prefetch_shell().
+
+    while i < len(lines) and lines[i].isspace():
+        i += 1
+    if i == len(lines):
+        return i
+
+    expline = lines[i].expandtabs()
+    indent = len(expline) - len(expline.lstrip())
+    if not indent:
+        # Empty help text. The line is parsed as usual.
+        return i
+
+    i += 1
+    while i < len(lines):
+        if not lines[i].isspace():
+            expline = lines[i].expandtabs()
+            if len(expline) - len(expline.lstrip()) < indent:
+                break
+        i += 1
+
+    return i
+
+
+def _tool_stamp(command):
+    # Returns the path and _file_stamp() of the program run by 'command' (e.g.
+    # the value of CC), or None if it can't be found. Used to detect toolchain
+    # updates for the $(shell) cache.
+
+    if not command:
+        return None
+
+    import shutil  # Only import as needed, to save some startup time
+
+    path = shutil.which(command.split()[0])
+    if path is None:
+        return None
+
+    try:
+        return (path, _file_stamp(path))
+    except EnvironmentError:
+        return None
+
+
+def _tool_stamps():
+    # Returns the _tool_stamp()s of the compiler and linker in CC and LD
+
+    return [_tool_stamp(os.getenv(name)) for name in ("CC", "LD")]
+
+
+def _snapshot_valid(env, stamps, source_globs, tool_stamps):
+    # Returns True if a snapshot written with the environment variable values
+    # 'env', the Kconfig file stamps 'stamps', the 'source' results
+    # 'source_globs', and the compiler and linker stamps 'tool_stamps' (None
+    # if no $(shell) commands were run) is still valid. See
+    # Kconfig._save_snapshot().
+
+    for name, val in env.items():
+        if os.environ.get(name) != val:
+            return False
+
+    try:
+        for path, stamp in stamps:
+            if _file_stamp(path) != stamp:
+                return False
+    except EnvironmentError:
+        # Removed Kconfig file
+        return False
+
+    for pattern, filenames in source_globs:
+        if sorted(iglob(pattern)) != filenames:
+            return False
+
+    return tool_stamps is None or tool_stamps == _tool_stamps()
+
+
+def _invalidate_dependents(item):
+    # Invalidates all items that (possibly) depend on 'item', which has just
+    # been invalidated. Uses an explicit stack instead of recursion, so that
+    # long dependency chains can't run into the recursion limit.
+
+    kconf = item.kconfig
+    gen = kconf._generation
+    stack = [item]
+    while stack:
+        for dep in stack.pop()._dependents:
+            # _cached_vis doubles as a flag that tells us whether 'dep' has
+            # cached values, because it's calculated as a side effect of
+            # calculating all other (non-constant) cached values.
+            #
+            # If dep._cached_vis is None, it means there can't be cached values
+            # on other items that depend on 'dep', because if there were, some
+            # value on 'dep' would have been calculated and dep._cached_vis set
+            # as a side effect. It's therefore safe to stop the invalidation at
+            # items with _cached_vis None. The same goes for items with cached
+            # values from an earlier generation, which are recalculated anyway
+            # and get moved to the current generation before any value that
+            # depends on them is calculated.
+            #
+            # This approach massively speeds up scripts that set a lot of
+            # values, vs simply invalidating all possibly dependent symbols
+            # (even when you already have a list of all the dependent symbols,
+            # because some symbols get huge dependency trees).
+            #
+            # This gracefully handles dependency loops too, which is nice for
+            # choices, where the choice depends on the choice symbols and vice
+            # versa.
+            if dep._cached_vis is not None and dep._cached_gen == gen:
+                if dep is kconf.modules:
+                    # Invalidating MODULES has wide-ranging effects
+                    kconf._invalidate_all()
+                    return
+
+                dep._invalidate()
+                stack.append(dep)
+
+
+def _snapshot_identity(obj):
+    # Used when loading snapshots, to get back an object that has already been
+    # unpickled, so that its slots can be filled in. See _SnapshotState.
+
+    return obj
+
+
+class _SnapshotState(object):
+    # Pickles as the slots of the Symbol, MenuNode, etc., object 'obj', which
+    # must already have been pickled. See Kconfig._save_snapshot().
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __reduce__(self):
+        obj = self.obj
+        state = {}
+        for name in obj.__slots__:
+            if name not in _SNAPSHOT_SKIP_SLOTS and hasattr(obj, name):
+                state[name] = getattr(obj, name)
+
+        # A (None, <slot dict>) state makes pickle assign the slots directly
+        return (_snapshot_identity, (obj,), (None, state))
+
+
+def _lines_hash(lines):
+    # Returns a hash of the contents of a Kconfig file, given as a list of
+    # lines. Used as the key for the token cache.
+
+    import hashlib  # Only import as needed, to save some startup time
+
+    contents = "".join(lines)
+    if not isinstance(contents, bytes):
+        contents = contents.encode("utf-8")
+
+    return hashlib.sha1(contents).digest()
+
+
 def _decoding_error(e, filename, macro_linenr=None):
     # Gives the filename and context for UnicodeDecodeError's, which are a pain
     # to debug otherwise. 'e' is the UnicodeDecodeError object.
@@ -6802,13 +8616,66 @@ def _error_if_fn(kconf, _, cond, msg):
     return ""
 
 
-def _shell_fn(kconf, _, command):
+def _run_shell_command(command):
+    # Runs 'command' in a shell and returns its undecoded
+    # (<stdout>, <stderr>) output
+
     import subprocess  # Only import as needed, to save some startup time
 
-    stdout, stderr = subprocess.Popen(
+    return subprocess.Popen(
         command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
     ).communicate()
 
+
+def _prefetch_shell_fn(kconf, _, command):
+    # Stand-in for _shell_fn() used by Kconfig._prefetch_shell(). Starts
+    # 'command' in the background, unless its output is already available.
+
+    if _PREFETCH_UNKNOWN not in command and \
+       command not in kconf._shell_futures and \
+       not (kconf._shell_cache and command in kconf._shell_cache):
+
+        kconf._shell_futures[command] = \
+            kconf._shell_executor.submit(_run_shell_command, command)
+
+    return _PREFETCH_UNKNOWN
+
+
+def _prefetch_blank_fn(kconf, *_):
+    # Stand-in for $(info), $(warning-if), and $(error-if) used by
+    # Kconfig._prefetch_shell(). These always expand to the empty string, and
+    # the messages are left to the parser.
+
+    return ""
+
+
+def _prefetch_unknown_fn(kconf, *_):
+    # Stand-in for other functions used by Kconfig._prefetch_shell(). Their
+    # result might depend on the parsing state (e.g. $(lineno)).
+
+    return _PREFETCH_UNKNOWN
+
+
+def _shell_fn(kconf, _, command):
+    if kconf._parsing_kconfigs:
+        kconf._shell_used = True
+
+    cache = kconf._shell_cache
+    if cache is not None and command in cache:
+        stdout, stderr = cache[command]
+    else:
+        if command in kconf._shell_futures:
+            # Started early by Kconfig._prefetch_shell()
+            stdout, stderr = kconf._shell_futures.pop(command).result()
+        else:
+            stdout, stderr = _run_shell_command(command)
+
+        if cache is not None:
+            # Store the undecoded output, so that warnings and decoding errors
+            # are reproduced for cached commands as well
+            cache[command] = (stdout, stderr)
+            kconf._shell_cache_dirty = True
+
     if not _IS_PY2:
         try:
             stdout = stdout.decode(kconf._encoding)
@@ -6851,6 +8718,77 @@ STR_TO_TRI = {
 # Symbol will do. We test this with 'is'.
 _NO_CACHED_SELECTION = 0
 
+# Maps expression structures to functions generated by _expr_factory(). See
+# expr_compile().
+_expr_factories = {}
+
+# Maximum AND/OR nesting depth for expr_compile(). Keeps the generated code
+# well within the indentation limit of the Python parser.
+_EXPR_COMPILE_MAX_DEPTH = 50
+
+# Classes whose instances are pickled as shells in snapshots. See
+# Kconfig._save_snapshot().
+_SNAPSHOT_CLASSES = (Kconfig, Symbol, Choice, MenuNode, Variable)
+
+# Slots holding parsing state that can't (and needn't) be stored in snapshots
+_SNAPSHOT_SKIP_SLOTS = frozenset({
+    "_batch_depth",
+    "_batch_invalidate",
+    "_exprs",
+    "_file_tokens",
+    "_help_lines",
+    "_line_warned",
+    "_parse_cache",
+    "_prefetch_stack",
+    "_readline",
+    "_shell_cache",
+    "_shell_cache_dirty",
+    "_shell_executor",
+    "_shell_futures",
+    "_shell_used",
+    "_token_cache",
+    "_token_cache_dirty",
+    "_tri_plan",
+})
+
+# Environment variables read by Kconfig._init() or commonly referenced from
+# Kconfig files. Snapshots are only reused if these have the same values.
+_SNAPSHOT_ENV_VARS = (
+    "ARCH",
+    "CC",
+    "CONFIG_",
+    "CROSS_COMPILE",
+    "KCONFIG_AUTOHEADER_HEADER",
+    "KCONFIG_CONFIG_HEADER",
+    "KCONFIG_FUNCTIONS",
+    "KCONFIG_STRICT",
+    "KCONFIG_WARN_UNDEF",
+    "KCONFIG_WARN_UNDEF_ASSIGN",
+    "LD",
+    "SRCARCH",
+    "srctree",
+)
+
+# Environment variables that select the toolchain used by $(shell) commands.
+# Part of the key for the $(shell) cache. See Kconfig._shell_cache_filename().
+_SHELL_CACHE_ENV_VARS = (
+    "CC",
+    "CROSS_COMPILE",
+    "LD",
+)
+
+# Stands in for function output that isn't known yet in
+# Kconfig._prefetch_shell(). Can't appear in Kconfig files.
+_PREFETCH_UNKNOWN = "\0"
+
+# Function overrides used by Kconfig._prefetch_shell()
+_PREFETCH_FUNCTIONS = {
+    "error-if":   (_prefetch_blank_fn, 2, 2),
+    "info":       (_prefetch_blank_fn, 1, 1),
+    "shell":      (_prefetch_shell_fn, 1, 1),
+    "warning-if": (_prefetch_blank_fn, 2, 2),
+}
+
 # Are we running on Python 2?
 _IS_PY2 = sys.version_info[0] < 3
 
@@ -7063,6 +9001,21 @@ _STRING_LEX = frozenset({
     _T_TRISTATE,
 })
 
+# Tokens for operators, for Kconfig._tokenize_regex()
+_OPERATOR_TOKENS = {
+    "!":  _T_NOT,
+    "!=": _T_UNEQUAL,
+    "&&": _T_AND,
+    "(":  _T_OPEN_PAREN,
+    ")":  _T_CLOSE_PAREN,
+    "<":  _T_LESS,
+    "<=": _T_LESS_EQUAL,
+    "=":  _T_EQUAL,
+    ">":  _T_GREATER,
+    ">=": _T_GREATER_EQUAL,
+    "||": _T_OR,
+}
+
 # Various sets for quick membership tests. Gives a single global lookup and
 # avoids creating temporary dicts/tuples.
 
@@ -7162,6 +9115,21 @@ _command_match = _re_match(r"\s*([A-Za-z0-9_$-]+)\s*")
 # '$' is included to detect identifiers containing macro expansions.
 _id_keyword_match = _re_match(r"([A-Za-z0-9_$/.-]+)\s*")
 
+# Finds the tokens after the first one for Kconfig._tokenize_regex(), with
+# trailing whitespace: identifiers/keywords, strings without macros or escapes,
+# operators, and comments (which eat the rest of the line). The groups hold the
+# matched identifier, string (with quotes), and operator, respectively. The
+# last group catches the rest of the line if it starts with anything else,
+# meaning it can only be set for the final match.
+_tokens_findall = re.compile(r"""
+    (?:
+        ([A-Za-z0-9_$/.-]+) |
+        ("[^"]*"|'[^']*') |
+        (&&|\|\||!=|<=|>=|[=!()<>]) |
+        \#.* |
+        (.+)
+    )\s*""", (0 if _IS_PY2 else re.ASCII) | re.DOTALL | re.VERBOSE).findall
+
 # A fragment in the left-hand side of a preprocessor variable assignment. These
 # are the portions between macro expansions ($(foo)). Macros are supported in
 # the LHS (variable name).
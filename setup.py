@@ -10,15 +10,12 @@ setup(
     author_email="ichiro_k@ca2.so-net.ne.jp",
     url="https://github.com/ikwzm/defconfig_explainer",
     packages=find_packages(),
-    py_modules=["defconfig_explainer"],
+    py_modules=["defconfig_explainer", "kconfiglib"],
     entry_points={
         "console_scripts": [
             "defconfig-explainer=defconfig_explainer:main",
         ],
     },
-    install_requires=[
-        "kconfiglib",
-    ],
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: BSD-2-Clause",
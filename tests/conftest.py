@@ -0,0 +1,26 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def kconfig_dir(tmp_path, monkeypatch):
+    # Returns a function that writes the files in the dict 'files' (name ->
+    # contents) to a temporary directory, which is made the current directory
+    # and $srctree
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("srctree", "")
+
+    def write(files):
+        for name, contents in files.items():
+            path = tmp_path / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(contents)
+        return tmp_path
+
+    return write
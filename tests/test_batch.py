@@ -0,0 +1,42 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+import gc
+import sys
+
+import pytest
+
+import defconfig_explainer
+
+
+KCONFIG = """
+config FOO
+\tbool "Foo"
+\thelp
+\t  Foo help.
+"""
+
+
+def run_main(monkeypatch, args):
+    monkeypatch.setattr(sys, "argv", ["defconfig-explainer"] + args)
+    defconfig_explainer.main()
+
+
+def test_batch(kconfig_dir, monkeypatch):
+    path = kconfig_dir({"Kconfig": KCONFIG,
+                        "foo_defconfig": "CONFIG_FOO=y\n",
+                        "batch": "-a x86 foo_defconfig -o out1\n"
+                                 "# comment\n"
+                                 "\n"
+                                 "-a arm64 -O print-help foo_defconfig -o out2\n"})
+    run_main(monkeypatch, ["--batch", "batch"])
+    assert "CONFIG_FOO=y" in (path / "out1").read_text()
+    assert "Foo help." in (path / "out2").read_text()
+    # The garbage collector is enabled again afterwards
+    assert gc.isenabled()
+
+
+def test_batch_error_restores_gc(kconfig_dir, monkeypatch):
+    kconfig_dir({"Kconfig": KCONFIG, "batch": "-a x86 missing_defconfig\n"})
+    with pytest.raises(Exception):
+        run_main(monkeypatch, ["--batch", "batch"])
+    assert gc.isenabled()
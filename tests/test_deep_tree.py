@@ -0,0 +1,127 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+import io
+import sys
+
+import pytest
+
+from defconfig_explainer import DefConfigExplainer
+
+
+# Nesting depth of the menus, beyond the recursion limit
+DEPTH = sys.getrecursionlimit() + 200
+
+OPTIONS = (
+    {},
+    {"print_help": True, "print_location": True},
+    {"print_same_level_item": True, "print_orig_config": True},
+    {"print_choice_item": True, "print_comment": True},
+)
+
+
+def make_kconfig(depth):
+    # Each menu has a symbol with a help text, and a symbol in an 'if' block
+    # that depends on it, which becomes a child of it
+    lines = ['mainmenu "Deep"\n']
+    for i in range(depth):
+        lines.append('menu "Menu {0}"\n'
+                     'config S{0}\n'
+                     '\tbool "Symbol {0}"\n'
+                     '\thelp\n'
+                     '\t  Help {0}\n'
+                     'if S{0}\n'
+                     'config T{0}\n'
+                     '\tbool "Symbol T{0}"\n'
+                     'endif\n'.format(i))
+    lines.append("endmenu\n" * depth)
+    return "".join(lines)
+
+
+def print_tree_recursive(explainer, node, force_print, out):
+    # The recursive walk that print_node_tree() replaced, as the reference
+    if explainer.print_same_level_item is True:
+        found_defined = False
+        all_symbol    = True
+        walk_node     = node
+        while walk_node:
+            if walk_node.defined:
+                found_defined = True
+            if not walk_node.is_symbol:
+                all_symbol = False
+            walk_node = walk_node.next
+        if found_defined is True and all_symbol is True:
+            force_print = True
+    while node:
+        if node.defined is True or force_print is True:
+            explainer.print_node(node, force_print, out)
+            if node.is_menu:
+                if node.list:
+                    print_choice_item = explainer.print_choice_item and node.is_choice
+                    print_tree_recursive(explainer, node.list, print_choice_item, out)
+                if node.prompt:
+                    format = explainer.print_menu_end_format[node.level]
+                    out.append(format(node.prompt))
+                    out.append("\n")
+            elif node.list:
+                print_tree_recursive(explainer, node.list, False, out)
+        node = node.next
+
+
+def print_recursive(explainer):
+    out = []
+    if explainer.print_first_level == 1:
+        print_tree_recursive(explainer, explainer.top_node.list, False, out)
+    else:
+        print_tree_recursive(explainer, explainer.top_node, False, out)
+    return "".join(out)
+
+
+@pytest.fixture(scope="module")
+def explainers(tmp_path_factory):
+    path = tmp_path_factory.mktemp("deep")
+    (path / "Kconfig").write_text(make_kconfig(DEPTH))
+    (path / "test_defconfig").write_text(
+        "CONFIG_S{0}=y\nCONFIG_T{0}=y\nCONFIG_S{1}=y\n"
+        .format(DEPTH - 1, DEPTH // 2))
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(path)
+        monkeypatch.setenv("srctree", "")
+
+        # Parsing the Kconfig files recurses once per menu level
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(20 * DEPTH)
+        try:
+            explainers = [DefConfigExplainer("Kconfig", sparse_tree=sparse_tree)
+                          for sparse_tree in (False, True)]
+        finally:
+            sys.setrecursionlimit(limit)
+
+        yield explainers
+
+
+@pytest.mark.parametrize("options", OPTIONS)
+def test_deep_tree(explainers, options):
+    texts = []
+    for explainer in explainers:
+        # Builds the tree
+        explainer.update_options(options)
+        explainer.load_config_files(defconfig_files=["test_defconfig"])
+        explainer.generate_print_format(options)
+        assert explainer.max_level > DEPTH
+
+        out = io.StringIO()
+        explainer.print(file=out)
+        texts.append(out.getvalue())
+
+    assert "CONFIG_S{}=y".format(DEPTH - 1) in texts[0]
+    assert "CONFIG_T{}=y".format(DEPTH - 1) in texts[0]
+    assert texts[1] == texts[0]
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(20 * DEPTH)
+    try:
+        for explainer, text in zip(explainers, texts):
+            assert print_recursive(explainer) == text
+    finally:
+        sys.setrecursionlimit(limit)
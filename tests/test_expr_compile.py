@@ -0,0 +1,166 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+import itertools
+
+import kconfiglib
+from kconfiglib import Kconfig, AND, OR, expr_compile, expr_value
+
+
+KCONFIG = """
+config MODULES
+\tbool "Modules"
+\toption modules
+
+config A
+\ttristate "A"
+
+config B
+\ttristate "B"
+
+config C
+\tbool "C"
+
+config S
+\tstring "S"
+
+config I
+\tint "I"
+
+config H
+\thex "H"
+"""
+
+# Expressions to compare. Some share a structure and differ only in their
+# operands, so that they share generated code.
+EXPRS = (
+    "A",
+    "B",
+    "m",
+    "y",
+    "!A",
+    "!!A",
+    "A && B",
+    "B && C",
+    "A || B",
+    "C || A",
+    "!(A && B)",
+    "!A || !B",
+    "A && B && C",
+    "C && A && B",
+    "(A || B) && !C",
+    "(C || B) && !A",
+    "A && (B || (C && !A))",
+    "A && m",
+    "A || m",
+    "m && !B",
+    "A = B",
+    "A != B",
+    "A = m",
+    "A = y && B != n",
+    "A < B",
+    "A <= B",
+    "A > B",
+    "A >= B",
+    'S = "foo"',
+    'S != "foo"',
+    'S < "foo"',
+    'S >= "foo"',
+    'S = ""',
+    "I = 10",
+    "I != 10",
+    "I < 10",
+    "I <= 10",
+    "I > 9",
+    "I >= 10",
+    "I < -3",
+    "H = 0x10",
+    "H < 0x10",
+    "H >= 0x1f",
+    "H > 16",
+    '(I > 9 || A) && !(S = "bar")',
+    '(H < 0x10 || B) && !(S = "foo")',
+)
+
+STR_VALUES = ("", "foo", "bar", "zzz")
+INT_VALUES = ("-5", "9", "10", "11")
+HEX_VALUES = ("0x0", "0x10", "0x1f", "0x20")
+
+
+def make_kconfig(kconfig_dir):
+    kconfig_dir({"Kconfig": KCONFIG + "".join(
+        "\nconfig E{}\n\tbool\n\tdepends on {}\n".format(i, expr)
+        for i, expr in enumerate(EXPRS))})
+
+    kconf = Kconfig(warn=False)
+    exprs = [kconf.syms["E{}".format(i)].nodes[0].dep
+             for i in range(len(EXPRS))]
+    return kconf, exprs
+
+
+def check(exprs, funcs):
+    for expr_s, expr, f in zip(EXPRS, exprs, funcs):
+        assert f() == expr_value(expr), expr_s
+
+
+def test_expr_compile(kconfig_dir):
+    kconf, exprs = make_kconfig(kconfig_dir)
+    funcs = [expr_compile(expr) for expr in exprs]
+
+    syms = kconf.syms
+    for modules, a, b, c in itertools.product(
+            (0, 2), (0, 1, 2), (0, 1, 2), (0, 2)):
+        syms["MODULES"].set_value(modules)
+        syms["A"].set_value(a)
+        syms["B"].set_value(b)
+        syms["C"].set_value(c)
+        check(exprs, funcs)
+
+    for modules in (0, 2):
+        syms["MODULES"].set_value(modules)
+        for s, i, h in zip(STR_VALUES, INT_VALUES, HEX_VALUES):
+            syms["S"].set_value(s)
+            syms["I"].set_value(i)
+            syms["H"].set_value(h)
+            check(exprs, funcs)
+
+
+def test_shared_structure(kconfig_dir):
+    kconf, exprs = make_kconfig(kconfig_dir)
+    syms = kconf.syms
+
+    syms["A"].set_value(2)
+    syms["B"].set_value(0)
+    syms["C"].set_value(2)
+
+    # Same structure, different operands
+    f1 = expr_compile((AND, syms["A"], syms["B"]))
+    f2 = expr_compile((AND, syms["A"], syms["C"]))
+    f3 = expr_compile((AND, syms["C"], syms["A"]))
+    assert (f1(), f2(), f3()) == (0, 2, 2)
+
+    n_factories = len(kconfiglib._expr_factories)
+    expr_compile((AND, syms["B"], syms["C"]))
+    assert len(kconfiglib._expr_factories) == n_factories
+
+
+def test_deep_fallback(kconfig_dir):
+    kconf, _ = make_kconfig(kconfig_dir)
+    syms = kconf.syms
+    operands = [syms["A"], syms["B"], syms["C"]]
+
+    for depth in (kconfiglib._EXPR_COMPILE_MAX_DEPTH - 1,
+                  kconfiglib._EXPR_COMPILE_MAX_DEPTH,
+                  kconfiglib._EXPR_COMPILE_MAX_DEPTH + 1,
+                  kconfiglib._EXPR_COMPILE_MAX_DEPTH + 30):
+        for op in AND, OR:
+            expr = syms["C"]
+            for i in range(depth):
+                expr = (op, operands[i % 3], expr)
+            f = expr_compile(expr)
+
+            for a, b, c in itertools.product((0, 1, 2), (0, 1, 2), (0, 2)):
+                syms["MODULES"].set_value(2)
+                syms["A"].set_value(a)
+                syms["B"].set_value(b)
+                syms["C"].set_value(c)
+                assert f() == expr_value(expr), (depth, op)
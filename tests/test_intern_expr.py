@@ -0,0 +1,39 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+from kconfiglib import Kconfig
+
+
+KCONFIG = """
+config A
+\tbool "A"
+\tdefault y
+
+config B
+\tbool "B"
+\tdepends on A || !D
+
+config C
+\tbool "C"
+\tdepends on A || !D
+
+config D
+\tbool "D"
+"""
+
+
+def test_shared_deps(kconfig_dir):
+    kconfig_dir({"Kconfig": KCONFIG})
+    kconf = Kconfig()
+
+    # Identical dependencies are the same tuple
+    assert kconf.syms["B"].direct_dep is kconf.syms["C"].direct_dep
+
+
+def test_eval_string_not_interned(kconfig_dir):
+    kconfig_dir({"Kconfig": KCONFIG})
+    kconf = Kconfig()
+
+    assert kconf._exprs is None
+    for i in range(5000):
+        assert kconf.eval_string("D && B = {}".format(i)) == 0
+    assert kconf._exprs is None
@@ -0,0 +1,62 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+import os
+
+from kconfiglib import Kconfig
+
+
+KCONFIG = """
+config A
+\tbool "A"
+\thelp
+\t  Help for A.
+
+\t  Second paragraph.
+
+source "sub/Kconfig"
+"""
+
+SUB_KCONFIG = """
+config B
+\tbool "B"
+\thelp
+\t  Help for B.
+
+config C
+\tbool "C"
+\thelp
+\t  Help for C.
+"""
+
+
+def helps(kconf):
+    return [getattr(node, "help", None) for node in kconf.node_iter()]
+
+
+def test_lazy_help_matches_eager(kconfig_dir):
+    kconfig_dir({"Kconfig": KCONFIG, "sub/Kconfig": SUB_KCONFIG})
+    assert helps(Kconfig(warn=False, lazy_help=True)) == helps(Kconfig(warn=False))
+
+
+def test_lazy_help_reads_each_file_once(kconfig_dir, monkeypatch):
+    kconfig_dir({"Kconfig": KCONFIG, "sub/Kconfig": SUB_KCONFIG})
+    kconf = Kconfig(warn=False, lazy_help=True)
+
+    reads = []
+    read_file_lines = Kconfig._read_file_lines
+    monkeypatch.setattr(Kconfig, "_read_file_lines",
+                        lambda self, filename: reads.append(filename) or
+                                               read_file_lines(self, filename))
+    helps(kconf)
+    assert sorted(reads) == ["Kconfig", os.path.join("sub", "Kconfig")]
+
+
+def test_lazy_help_modified_file(kconfig_dir):
+    path = kconfig_dir({"Kconfig": KCONFIG, "sub/Kconfig": SUB_KCONFIG})
+    kconf = Kconfig(warn=True, warn_to_stderr=False, lazy_help=True)
+    with open(path / "sub" / "Kconfig", "a") as f:
+        f.write("\n# modified\n")
+
+    assert kconf.syms["A"].nodes[0].help == "Help for A.\n\nSecond paragraph."
+    assert kconf.syms["B"].nodes[0].help == ""
+    assert "sub/Kconfig' was modified" in kconf.warnings[-1]
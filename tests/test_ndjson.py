@@ -0,0 +1,52 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+import json
+import sys
+
+import defconfig_explainer
+
+
+KCONFIG = """
+menu "Menu"
+
+config FOO
+\tbool "Foo"
+\thelp
+\t  Foo help.
+
+config BAR
+\tint "Bar"
+
+endmenu
+"""
+
+
+def run_main(monkeypatch, args):
+    monkeypatch.setattr(sys, "argv", ["defconfig-explainer"] + args)
+    defconfig_explainer.main()
+
+
+def test_ndjson(kconfig_dir, monkeypatch):
+    path = kconfig_dir({"Kconfig": KCONFIG,
+                        "foo_defconfig": "# Foo\nCONFIG_FOO=y\nCONFIG_BAR=3\n"})
+    run_main(monkeypatch, ["-a", "x86", "--format", "ndjson", "-o", "out", "foo_defconfig"])
+
+    records = [json.loads(line) for line in (path / "out").read_text().splitlines()]
+    assert [record["name"] for record in records] == ["FOO", "BAR"]
+    assert records[0]["help"] == "Foo help."
+    assert records[0]["menu"] == ["Menu"]
+    assert records[0]["comment"] == "# Foo"
+    assert (records[0]["value"], records[1]["value"]) == ("y", "3")
+
+
+def test_ndjson_verbose(kconfig_dir, monkeypatch, capsys):
+    path = kconfig_dir({"Kconfig": KCONFIG, "foo_defconfig": "CONFIG_FOO=y\n"})
+    run_main(monkeypatch, ["-a", "x86", "--format", "ndjson", "-v", "-o", "out", "foo_defconfig"])
+
+    # The verbose output goes to stderr, where it doesn't get mixed with
+    # the records when they are written to stdout
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert "## export ARCH=x86" in captured.err
+    records = [json.loads(line) for line in (path / "out").read_text().splitlines()]
+    assert [record["name"] for record in records] == ["FOO"]
@@ -0,0 +1,73 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+import os
+
+from kconfiglib import Kconfig
+
+
+KCONFIG = """
+config V
+\tstring
+\tdefault "$(shell,$(CC))"
+
+config W
+\tbool "W"
+"""
+
+
+def write_cc(path, output, mtime):
+    path.write_text("#!/bin/sh\necho {}\n".format(output))
+    path.chmod(0o755)
+    os.utime(str(path), (mtime, mtime))
+
+
+def test_tool_update(kconfig_dir, monkeypatch):
+    path = kconfig_dir({"Kconfig": KCONFIG})
+    cc = path / "cc"
+    monkeypatch.setenv("CC", str(cc))
+
+    write_cc(cc, "v1", 1000000000)
+    for _ in range(2):
+        assert Kconfig(cache_dir="cache").syms["V"].str_value == "v1"
+
+    # Same CC, but the binary changed
+    write_cc(cc, "v2", 1000000100)
+    for shell_cache in True, False:
+        kconf = Kconfig(cache_dir="cache", shell_cache=shell_cache)
+        assert kconf.syms["V"].str_value == "v2"
+
+
+def test_no_shell_cache(kconfig_dir, monkeypatch):
+    path = kconfig_dir({"Kconfig": KCONFIG, "out": "v1"})
+    monkeypatch.setenv("CC", "cat out")
+
+    assert Kconfig(cache_dir="cache").syms["V"].str_value == "v1"
+
+    # Without the $(shell) cache, the command is run again instead of using
+    # the snapshot
+    (path / "out").write_text("v2")
+    kconf = Kconfig(cache_dir="cache", shell_cache=False)
+    assert kconf.syms["V"].str_value == "v2"
+
+
+def test_snapshot_without_shell(kconfig_dir, monkeypatch):
+    kconfig_dir({"Kconfig": KCONFIG.replace("$(shell,$(CC))", "foo")})
+
+    Kconfig(cache_dir="cache")
+
+    def no_parse(*args):
+        raise AssertionError("the snapshot was not used")
+
+    # Snapshots without $(shell) output are also used without the cache
+    monkeypatch.setattr(Kconfig, "_init", no_parse)
+    kconf = Kconfig(cache_dir="cache", shell_cache=False)
+    assert kconf.syms["V"].str_value == "foo"
+
+
+def test_eval_string_shell(kconfig_dir):
+    kconfig_dir({"Kconfig": KCONFIG.replace("$(shell,$(CC))", "foo")})
+
+    for _ in range(2):
+        kconf = Kconfig(cache_dir="cache")
+        assert kconf.eval_string("$(shell,echo y)") == 2
+        assert kconf.eval_string('V = "$(shell,echo foo)"') == 2
@@ -0,0 +1,68 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+import io
+
+import pytest
+
+from defconfig_explainer import DefConfigExplainer
+
+
+KCONFIG = """
+config I
+\tint "I"
+
+menu "Menu 1"
+
+config A
+\tbool "A"
+
+config B
+\tbool "B"
+
+endmenu
+
+menu "Menu 2"
+\tdepends on I
+
+config C
+\tbool "C"
+
+endmenu
+"""
+
+
+def explain(sparse_tree, options):
+    explainer = DefConfigExplainer("Kconfig", {}, sparse_tree=sparse_tree)
+    explainer.update_options(options)
+    explainer.update_kconf_option()
+    explainer.load_config_files(defconfig_files=["test_defconfig"])
+    out = io.StringIO()
+    explainer.print(file=out)
+    return explainer, out.getvalue()
+
+
+@pytest.mark.parametrize("options", [{}, {"print_same_level_item": True}])
+def test_sparse_tree(kconfig_dir, options):
+    kconfig_dir({"Kconfig": KCONFIG, "test_defconfig": "CONFIG_A=y\n"})
+
+    explainer, text = explain(True, options)
+    assert explainer.sparse_tree_options is not None
+    assert "CONFIG_A=y" in text
+    assert explain(False, options)[1] == text
+
+
+def test_warnings(kconfig_dir):
+    kconfig_dir({"Kconfig": KCONFIG, "test_defconfig": "CONFIG_A=y\n"})
+
+    # The full tree is built while warnings are enabled, so that the warning
+    # for the dependency of the skipped menu is still raised
+    explainer, text = explain(True, {"warnings": True})
+    assert explainer.sparse_tree_options is None
+    assert any("logical context" in warning
+               for warning in explainer.kconf.warnings)
+    assert explain(False, {"warnings": True})[1] == text
+    assert explain(True, {})[1] == text
+
+    # Changing the print options keeps the full tree
+    explainer.generate_print_format({"print_same_level_item": True})
+    assert explainer.sparse_tree_options is None
@@ -0,0 +1,207 @@
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Kconfig(regex_tokenizer=True) must give the same tokens, symbols and
+# warnings as the default tokenizer
+
+import pytest
+
+from kconfiglib import Kconfig, KconfigError, Symbol
+
+
+# Lines as readline() returns them. Preprocessor variable assignments come
+# before the lines that use them.
+LINES = [
+    'config FOO\n',
+    'menuconfig BAR\n',
+    '\tbool "Prompt with \\"escaped\\" quotes"\n',
+    "\ttristate 'Single \\'quoted\\' prompt' if BAR\n",
+    '\tprompt "Backslash \\\\ in prompt"\n',
+    '\tdepends on A && (B || !C) && D != "x" && E = F\n',
+    '\tdepends on N < 5 || N <= 3 || N > 1 || N >= 2\n',
+    '\tdepends on !(A&&B)||C!=D\n',
+    '\tdepends on "const" = y && m != n\n',
+    '\tdefault y if MODULES # trailing comment\n',
+    '\tdefault "string" if !FOO\n',
+    '\tdefault 0x10\n',
+    '\trange 0x10 0xff if BAR\n',
+    '\tselect SEL if A\n',
+    '\timply IMP\n',
+    '\tdef_bool y\n',
+    '\tdef_tristate m && FOO\n',
+    '\toption env="ARCH"\n',
+    '\toption modules\n',
+    '\tmodules\n',
+    '\thelp\n',
+    '\t---help---\n',
+    '---help---\n',
+    'help\n',
+    '# comment line\n',
+    '\t# indented comment\n',
+    '\n',
+    '   \n',
+    'menu "Menu"\n',
+    'menu MissingQuotes\n',
+    'comment "Comment" # after\n',
+    'mainmenu "Main menu"\n',
+    'choice\n',
+    'choice NAMED_CHOICE\n',
+    'endchoice\n',
+    'if A && B\n',
+    'endif\n',
+    'visible if FOO\n',
+    'source "sub/Kconfig"\n',
+    'rsource "sub/Kconfig"\n',
+    'osource "sub/*/Kconfig"\n',
+    'orsource "sub/*/Kconfig"\n',
+    'VAR := value\n',
+    'RVAR = $(VAR)-recursive\n',
+    'APPEND += more\n',
+    'FUNC = $(1),$(2)\n',
+    '\tdefault "$(VAR)"\n',
+    '\tdefault $(RVAR)\n',
+    '\tdepends on $(FUNC,A,B)\n',
+    '\tprompt "$(APPEND) \\"$(VAR)\\""\n',
+    '\tdepends on $(UNDEFINED) || FOO\n',
+    'config $(VAR)_SYM\n',
+    '$(info,info from macro)\n',
+    '\tbool\t"tab\tseparated"\n',
+    '\tdepends on FOO\t&&\tBAR\n',
+    '\tdepends on FOO\x0c&& BAR\n',
+    '\tdefault "unterminated\n',
+    '\tdepends on FOO &\n',
+    '\tdepends on FOO | BAR\n',
+    '\tdepends on FOO @ BAR\n',
+    'nonsense here\n',
+    'config\n',
+    '\tdepends on y && n || m\n',
+    '\tdepends on "y" || "n"\n',
+]
+
+
+def token_repr(token):
+    if token.__class__ is Symbol:
+        return ("sym", token.name, token.is_constant)
+    return token
+
+
+def tokenize_lines(regex_tokenizer):
+    kconf = Kconfig(warn=True, warn_to_stderr=False)
+    # Tokenize like the parser does
+    kconf._parsing_kconfigs = True
+    tokenize = kconf._tokenize_regex if regex_tokenizer else kconf._tokenize
+    results = []
+    for linenr, line in enumerate(LINES, 1):
+        kconf.linenr = linenr
+        try:
+            results.append([token_repr(token) for token in tokenize(line)])
+        except KconfigError as e:
+            results.append(("error", str(e)))
+    return results, kconf.warnings, list(kconf.syms), list(kconf.const_syms)
+
+
+@pytest.fixture
+def empty_kconfig(kconfig_dir):
+    kconfig_dir({"Kconfig": ""})
+
+
+def test_token_streams(empty_kconfig):
+    tokens, warnings, syms, const_syms = tokenize_lines(False)
+    regex_tokens, regex_warnings, regex_syms, regex_const_syms = \
+        tokenize_lines(True)
+
+    for line, expected, got in zip(LINES, tokens, regex_tokens):
+        assert got == expected, line
+    assert regex_warnings == warnings
+    # Symbols are registered in the same order
+    assert regex_syms == syms
+    assert regex_const_syms == const_syms
+
+
+KCONFIG = """
+mainmenu "Tokenizer test"
+
+VAR := value
+RVAR = $(VAR)-recursive
+
+config MODULES
+\tbool "Modules"
+\toption modules
+
+config X
+\tbool "X"
+
+config Y
+\tstring "Y"
+
+config M
+\thex "M"
+
+menuconfig FOO
+\tbool "Foo \\"quoted\\" $(VAR)"
+\tdepends on (X || !MODULES) && Y != "x" && M >= 0x2 # comment
+\tdefault y if MODULES
+\t---help---
+\t  Help with "quotes" and $(VAR).
+
+if FOO
+
+config A
+\ttristate 'A' if FOO
+\tselect S if B
+\timply I
+
+config B
+\tbool prompt_without_quotes
+
+config C
+\tstring "C"
+\tdefault "c"
+
+config N
+\tint "N"
+\trange 0 10 if !A
+\tdefault 3
+
+config $(VAR)_SYM
+\tdef_bool $(RVAR) = "value-recursive"
+
+endif
+
+choice NAMED
+\tprompt "Choice"
+
+config CH1
+\tbool "Ch1"
+
+config CH2
+\tbool "Ch2"
+\tdepends on N < 5 || N <= 4 || N > 1
+
+endchoice
+
+config S
+\tbool
+
+config I
+\ttristate
+
+menu "Menu"
+\tvisible if FOO
+
+comment "Comment"
+\tdepends on A=y
+
+endmenu
+"""
+
+
+def parse_dump(regex_tokenizer):
+    kconf = Kconfig(warn=True, warn_to_stderr=False,
+                    regex_tokenizer=regex_tokenizer)
+    return ([str(node) for node in kconf.node_iter()], kconf.warnings,
+            list(kconf.syms))
+
+
+def test_parse(kconfig_dir):
+    kconfig_dir({"Kconfig": KCONFIG})
+    assert parse_dump(True) == parse_dump(False)
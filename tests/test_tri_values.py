@@ -0,0 +1,190 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+import itertools
+
+import pytest
+
+from kconfiglib import Kconfig
+
+
+KCONFIG = """
+config MODULES
+\tbool "Modules"
+\toption modules
+\tdefault y
+
+config A
+\ttristate "A"
+
+config B
+\ttristate "B"
+\tselect C
+\timply D
+
+# Selected, but with unmet dependencies
+config C
+\ttristate
+\tdepends on E
+
+config D
+\ttristate "D"
+\tdepends on A
+
+config E
+\tbool "E"
+
+config F
+\ttristate "F"
+\tdefault m
+\tdepends on B
+
+config G
+\tbool
+\tdefault y
+\tdepends on F
+
+config H
+\ttristate "H"
+\tdefault A if B
+\tdefault m
+
+config I
+\ttristate
+\tdefault y
+\tdepends on m
+
+choice T
+\ttristate "Tristate choice"
+\tdefault TB
+
+config TA
+\ttristate "TA"
+
+config TB
+\ttristate "TB"
+\tdepends on A
+
+endchoice
+
+choice
+\tbool "Optional bool choice"
+\toptional
+
+config BA
+\tbool "BA"
+
+config BB
+\tbool "BB"
+\tselect E
+
+endchoice
+
+config J
+\ttristate "J"
+\tdepends on TA || BB
+\tselect F if H
+
+menuconfig K
+\tbool "K"
+
+if K
+
+config KA
+\ttristate "KA"
+\tdefault m
+
+config KB
+\ttristate "KB"
+\tdefault KA
+\timply A
+
+endif
+
+config L0
+\ttristate "L0"
+\tdefault y
+""" + "".join("""
+config L{}
+\ttristate "L{}"
+\tdefault y
+\tdepends on L{}
+""".format(i, i, i - 1) for i in range(1, 300))
+
+# Assignments that are combined into configurations
+ASSIGNMENTS = (
+    ("CONFIG_MODULES=y", "# CONFIG_MODULES is not set"),
+    ("CONFIG_A=y", "CONFIG_A=m", "# CONFIG_A is not set"),
+    ("CONFIG_B=y", "CONFIG_B=m", "# CONFIG_B is not set"),
+    ("CONFIG_E=y", "# CONFIG_E is not set"),
+    ("CONFIG_TA=y", "CONFIG_TA=m\nCONFIG_TB=m", "CONFIG_TB=y"),
+    ("CONFIG_BB=y", "CONFIG_BA=y", ""),
+    ("CONFIG_J=m\nCONFIG_H=y", "CONFIG_J=y\n# CONFIG_H is not set"),
+    ("CONFIG_K=y\nCONFIG_KA=y", "CONFIG_K=y", "# CONFIG_K is not set"),
+    ("CONFIG_L0=m", "# CONFIG_L150 is not set", ""),
+)
+
+CONFIGS = ["\n".join(assignments) + "\n"
+           for assignments in itertools.product(*ASSIGNMENTS)]
+
+
+def check(kconf, ref, tmp_path):
+    # Compares the values from kconf.tri_values() with the values from
+    # Symbol/Choice.tri_value in 'ref', which has the same configuration
+    # loaded
+
+    vals = kconf.tri_values()
+    for sym in kconf.unique_defined_syms:
+        assert vals[sym] == ref.syms[sym.name].tri_value, sym.name
+    for choice, ref_choice in zip(kconf.unique_choices, ref.unique_choices):
+        assert vals[choice] == ref_choice.tri_value, choice.name
+
+    kconf.write_config(str(tmp_path / "a.config"), save_old=False)
+    ref.write_config(str(tmp_path / "b.config"), save_old=False)
+    assert (tmp_path / "a.config").read_text() == \
+           (tmp_path / "b.config").read_text()
+
+
+@pytest.fixture
+def kconfs(kconfig_dir):
+    kconfig_dir({"Kconfig": KCONFIG})
+    return Kconfig(warn=False), Kconfig(warn=False)
+
+
+def test_tri_values(kconfs, tmp_path):
+    # The same Kconfig instance is reused, like when explaining many
+    # configurations
+    kconf, ref = kconfs
+
+    for config in CONFIGS[::7]:
+        (tmp_path / ".config").write_text(config)
+        kconf.load_config(str(tmp_path / ".config"), verbose=False)
+        ref.load_config(str(tmp_path / ".config"), verbose=False)
+        check(kconf, ref, tmp_path)
+
+
+def test_set_value(kconfs, tmp_path):
+    kconf, ref = kconfs
+
+    for name, value in (("A", 2), ("B", 1), ("E", 2), ("MODULES", 0),
+                        ("BB", 2), ("K", 2), ("B", 2), ("MODULES", 2),
+                        ("T", 1), ("L0", 1), ("L10", 0)):
+        if name in kconf.syms:
+            sc, ref_sc = kconf.syms[name], ref.syms[name]
+        else:
+            sc, ref_sc = kconf.named_choices[name], ref.named_choices[name]
+        assert sc.set_value(value) == ref_sc.set_value(value)
+        check(kconf, ref, tmp_path)
+
+
+def test_fresh(kconfig_dir, tmp_path):
+    # tri_values() as the first thing that is evaluated, for each
+    # configuration
+    kconfig_dir({"Kconfig": KCONFIG})
+
+    for config in CONFIGS[::97]:
+        kconf = Kconfig(warn=False)
+        ref = Kconfig(warn=False)
+        (tmp_path / ".config").write_text(config)
+        kconf.load_config(str(tmp_path / ".config"), verbose=False)
+        ref.load_config(str(tmp_path / ".config"), verbose=False)
+        check(kconf, ref, tmp_path)